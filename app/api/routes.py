@@ -3,37 +3,34 @@
 from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect, BackgroundTasks
 from fastapi.responses import HTMLResponse, JSONResponse
 from typing import Dict, Any
+from dataclasses import asdict
 import json
+import logging
 import uuid
 import asyncio
+from collections import defaultdict
+from contextlib import aclosing
 
+from app.config import settings
 from app.services import claude_service, executor_service
+from app.services.action_parser import ActionDetector
+from app.services.action_plan import ActionResult, format_results
+from app.services.admission import ServerBusyError, PRIORITY_BACKGROUND
+from app.services.stream_parser import (
+    TextDelta, ThinkingDelta, ToolUse, ToolResult, Result, ErrorEvent
+)
 from app.platforms import feishu_platform
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 
 # ==================== 飞书 Webhook ====================
 
-# 消息去重缓存（防止重复处理）
-_processed_messages: Dict[str, float] = {}
-
-
 def _is_duplicate_message(message_id: str) -> bool:
-    """检查是否重复消息"""
-    import time
-    now = time.time()
-
-    # 清理过期记录（5分钟前的）
-    expired = [k for k, v in _processed_messages.items() if now - v > 300]
-    for k in expired:
-        del _processed_messages[k]
-
-    if message_id in _processed_messages:
-        return True
-
-    _processed_messages[message_id] = now
-    return False
+    """检查是否重复消息（与飞书 WebSocket 通道共用同一个去重集合）"""
+    return not feishu_platform.processed_messages.add(message_id)
 
 
 async def process_feishu_message(event: Dict[str, Any]):
@@ -56,11 +53,60 @@ async def process_feishu_message(event: Dict[str, Any]):
     # 使用伪流式回复
     await feishu_platform.reply_stream(
         message_id=message_id,
-        content_generator=claude_service.chat_stream(full_prompt, session_id),
+        content_generator=_feishu_reply_generator(full_prompt, session_id),
         update_interval=0.8  # 0.8秒更新一次，避免限流
     )
 
 
+async def _feishu_reply_generator(prompt: str, session_id: str):
+    """AI 回复 + （可选）自动执行操作的输出，合并到同一张卡片流式展示
+
+    操作块一闭合就在后台开始执行；回复结束后按操作顺序展示输出，
+    正在执行的操作逐行推送，其余操作的输出先缓存，轮到时再展示。
+    """
+    detector = ActionDetector()
+    # 每个操作一个输出队列，None 表示该操作结束
+    outputs: Dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+    streamed: Dict[int, str] = defaultdict(str)
+
+    async def on_output(index: int, chunk: str):
+        streamed[index] += chunk
+        outputs[index].put_nowait(chunk)
+
+    async def on_result(result: ActionResult):
+        # 跳过、执行异常等不经过 on_output 的内容补在最后
+        sent = streamed[result.index]
+        rest = result.output[len(sent):] if result.output.startswith(sent) else f"\n{result.output}"
+        if rest:
+            outputs[result.index].put_nowait(rest)
+        outputs[result.index].put_nowait(None)
+
+    plan = executor_service.plan(on_output=on_output, on_result=on_result)
+    count = 0
+    try:
+        try:
+            events = claude_service.chat_events(prompt, session_id, priority=PRIORITY_BACKGROUND)
+            async with aclosing(events):
+                async for event in events:
+                    if isinstance(event, TextDelta) and settings.feishu_auto_execute:
+                        for action in detector.feed(event.text):
+                            plan.add(action)
+                            count += 1
+                    # 工具调用、错误等由卡片渲染为状态行
+                    yield event
+        except ServerBusyError:
+            yield "⏳ 当前请求较多，服务繁忙，请稍后再试"
+            return
+
+        for index in range(count):
+            yield f"\n\n---\n[{index + 1}/{count}] " if count > 1 else "\n\n---\n"
+            while (chunk := await outputs[index].get()) is not None:
+                yield chunk
+    finally:
+        # 卡片推送出错或中途停止时终止仍在执行的操作
+        await plan.cancel()
+
+
 @router.post("/webhook/feishu")
 async def feishu_webhook(request: Request, background_tasks: BackgroundTasks):
     """飞书事件回调"""
@@ -98,27 +144,37 @@ async def chat(request: Request):
     message = data.get("message", "")
     session_id = data.get("session_id", str(uuid.uuid4()))
     auto_execute = data.get("auto_execute", False)
+    use_cache = not data.get("no_cache", False)
 
     if not message:
         return JSONResponse({"error": "消息不能为空"}, status_code=400)
 
-    # 调用 Claude
-    response = await claude_service.chat(message, session_id)
+    # 调用 Claude（同一会话排在前面的轮次数）
+    queue_position = claude_service.queue_position(session_id)
+    try:
+        response = await claude_service.chat(message, session_id, use_cache=use_cache)
+    except ServerBusyError as e:
+        return JSONResponse({"error": str(e)}, status_code=429)
 
     result = {
         "response": response,
         "session_id": session_id,
+        "queue_position": queue_position,
         "action": None,
-        "action_result": None
+        "actions": [],
+        "action_result": None,
+        "action_results": None
     }
 
-    # 检查是否有需要执行的操作
-    action = executor_service.parse_action(response)
-    if action:
-        result["action"] = action
+    # 检查是否有需要执行的操作（action 为第一个操作，兼容旧客户端）
+    actions = executor_service.parse_actions(response)
+    result["actions"] = actions
+    if actions:
+        result["action"] = actions[0]
         if auto_execute:
-            action_result = await executor_service.process_action(action)
-            result["action_result"] = action_result
+            action_results = await executor_service.process_actions(actions)
+            result["action_result"] = format_results(action_results)
+            result["action_results"] = [asdict(r) for r in action_results]
 
     return JSONResponse(result)
 
@@ -127,13 +183,16 @@ async def chat(request: Request):
 async def execute_action(request: Request):
     """执行操作 API"""
     data = await request.json()
-    action = data.get("action")
+    actions = data.get("actions") or ([data["action"]] if data.get("action") else [])
 
-    if not action:
+    if not actions:
         return JSONResponse({"error": "操作不能为空"}, status_code=400)
 
-    result = await executor_service.process_action(action)
-    return JSONResponse({"result": result})
+    results = await executor_service.process_actions(actions)
+    return JSONResponse({
+        "result": format_results(results),
+        "results": [asdict(r) for r in results]
+    })
 
 
 @router.post("/api/clear")
@@ -145,42 +204,158 @@ async def clear_session(request: Request):
     return JSONResponse({"message": "会话已清除"})
 
 
+@router.post("/api/cancel")
+async def cancel(request: Request):
+    """取消会话进行中的回复"""
+    data = await request.json()
+    session_id = data.get("session_id", "default")
+    cancelled = await claude_service.cancel(session_id)
+    return JSONResponse({"cancelled": cancelled})
+
+
+@router.get("/api/stats")
+async def stats():
+    """运行指标"""
+    return JSONResponse(claude_service.stats())
+
+
 # ==================== WebSocket ====================
 
 @router.websocket("/ws/chat")
 async def websocket_chat(websocket: WebSocket):
     """WebSocket 聊天"""
     await websocket.accept()
-    session_id = str(uuid.uuid4())
+    # 客户端可带上 session_id 在重连后继续之前的会话（复用 CLI 会话上下文）
+    session_id = websocket.query_params.get("session_id") or str(uuid.uuid4())
+
+    # 消息按顺序交给后台任务处理，接收循环保持读取，才能及时发现断开和 /cancel
+    inbox: asyncio.Queue = asyncio.Queue()
+    busy = False
+
+    async def worker():
+        nonlocal busy
+        while True:
+            message_data = await inbox.get()
+            busy = True
+            try:
+                await _handle_ws_message(websocket, session_id, message_data)
+            except Exception as e:
+                # 单条消息出错不影响后续消息的处理
+                logger.exception(f"Failed to handle WebSocket message: {e}")
+                try:
+                    await websocket.send_json({"type": "error", "message": f"处理消息失败: {str(e)}"})
+                except Exception:
+                    # 连接已断开，由接收循环结束
+                    pass
+            finally:
+                busy = False
+
+    worker_task = asyncio.create_task(worker())
 
     try:
         while True:
             data = await websocket.receive_text()
             message_data = json.loads(data)
-            message = message_data.get("message", "")
-            auto_execute = message_data.get("auto_execute", False)
 
-            if message == "/clear":
-                claude_service.clear_conversation(session_id)
-                await websocket.send_json({"type": "system", "message": "会话已清除"})
+            if message_data.get("message", "") == "/cancel":
+                cancelled = await claude_service.cancel(session_id)
+                await websocket.send_json({
+                    "type": "system",
+                    "message": "已取消当前回复" if cancelled else "没有进行中的回复"
+                })
                 continue
 
-            # 流式响应
-            full_response = ""
-            async for chunk in claude_service.chat_stream(message, session_id):
-                full_response += chunk
-                await websocket.send_json({"type": "chunk", "content": chunk})
-
-            # 发送完成信号
-            await websocket.send_json({"type": "done", "content": full_response})
-
-            # 检查并执行操作
-            action = executor_service.parse_action(full_response)
-            if action:
-                await websocket.send_json({"type": "action", "action": action})
-                if auto_execute:
-                    result = await executor_service.process_action(action)
-                    await websocket.send_json({"type": "action_result", "result": result})
+            # 入队时告知排队位置：前面还有收件箱里的消息，以及正在处理的一轮
+            # （本连接空闲时看同一会话在其他连接上的轮次）
+            position = inbox.qsize() + (1 if busy else claude_service.queue_position(session_id))
+            if position and message_data.get("message") != "/clear":
+                await websocket.send_json({"type": "queued", "position": position})
+            await inbox.put(message_data)
 
     except WebSocketDisconnect:
         pass
+    finally:
+        # 断开后立即终止进行中的 claude 进程 / 命令，释放名额
+        worker_task.cancel()
+        try:
+            await worker_task
+        except (asyncio.CancelledError, Exception):
+            pass
+
+
+async def _handle_ws_message(websocket: WebSocket, session_id: str, message_data: Dict[str, Any]):
+    """处理一条 WebSocket 消息"""
+    message = message_data.get("message", "")
+    auto_execute = message_data.get("auto_execute", False)
+    use_cache = not message_data.get("no_cache", False)
+
+    if message == "/clear":
+        claude_service.clear_conversation(session_id)
+        await websocket.send_json({"type": "system", "message": "会话已清除"})
+        return
+
+    # 回复和操作输出可能同时推送，串行化发送
+    send_lock = asyncio.Lock()
+
+    async def send(frame: Dict[str, Any]):
+        async with send_lock:
+            await websocket.send_json(frame)
+
+    # 各操作的输出逐行推送（带序号），每个操作完成时发送其完整结果
+    async def on_output(index: int, chunk: str):
+        await send({"type": "action_chunk", "index": index, "content": chunk})
+
+    async def on_result(result: ActionResult):
+        await send({
+            "type": "action_result", "index": result.index,
+            "success": result.success, "skipped": result.skipped, "result": result.output
+        })
+
+    # 流式响应（aclosing：发送失败或任务取消时立即关闭生成器，杀掉 claude 进程）
+    full_response = ""
+    detector = ActionDetector()
+    plan = executor_service.plan(on_output=on_output, on_result=on_result)
+    index = 0
+    try:
+        try:
+            async with aclosing(claude_service.chat_events(message, session_id, use_cache=use_cache)) as events:
+                async for event in events:
+                    if isinstance(event, TextDelta):
+                        full_response += event.text
+                        await send({"type": "chunk", "content": event.text})
+                        for action in detector.feed(event.text):
+                            # 操作块一闭合就告知客户端，开启自动执行时立即开始调度
+                            await send({"type": "action", "index": index, "action": action})
+                            index += 1
+                            if auto_execute:
+                                plan.add(action)
+                    elif isinstance(event, ThinkingDelta):
+                        await send({"type": "thinking", "content": event.text})
+                    elif isinstance(event, ToolUse):
+                        await send({
+                            "type": "tool_use", "id": event.id, "name": event.name, "input": event.input
+                        })
+                    elif isinstance(event, ToolResult):
+                        await send({
+                            "type": "tool_result", "id": event.tool_use_id,
+                            "content": event.content, "is_error": event.is_error
+                        })
+                    elif isinstance(event, Result):
+                        await send({
+                            "type": "usage", "usage": event.usage, "cost_usd": event.cost_usd,
+                            "duration_ms": event.duration_ms, "num_turns": event.num_turns
+                        })
+                    elif isinstance(event, ErrorEvent):
+                        full_response += f"错误: {event.message}"
+                        await send({"type": "chunk", "content": f"错误: {event.message}"})
+        except ServerBusyError as e:
+            await send({"type": "error", "message": str(e)})
+            return
+
+        # 发送完成信号
+        await send({"type": "done", "content": full_response})
+
+        await plan.wait()
+    finally:
+        # 断开或取消时终止仍在执行的操作
+        await plan.cancel()
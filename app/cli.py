@@ -2,12 +2,15 @@
 
 import typer
 import asyncio
+from contextlib import aclosing
+from typing import Any, Dict, List, Optional, Tuple
 from rich.console import Console
 from rich.markdown import Markdown
 from rich.panel import Panel
 from rich.prompt import Prompt
 
 from app.services import claude_service, executor_service
+from app.services.stream_parser import TextDelta, ToolUse, Result, ErrorEvent
 
 app = typer.Typer(help="Chat Work - 通过聊天就能工作")
 console = Console()
@@ -28,6 +31,42 @@ def print_error(message: str):
     console.print(Panel(message, title="❌ 错误", border_style="red"))
 
 
+async def run_actions(actions: List[Dict[str, Any]]):
+    """执行一组操作并逐个打印结果"""
+    for result in await executor_service.process_actions(actions):
+        print_action_result(result.output)
+
+
+def print_usage(result: Result):
+    """打印本轮用量"""
+    usage = result.usage
+    parts = [f"输入 {usage.get('input_tokens', 0)} / 输出 {usage.get('output_tokens', 0)} tokens"]
+    if result.duration_ms is not None:
+        parts.append(f"{result.duration_ms / 1000:.1f}s")
+    if result.cost_usd is not None:
+        parts.append(f"${result.cost_usd:.4f}")
+    console.print(f"[dim]{' · '.join(parts)}[/dim]")
+
+
+async def stream_reply(message: str, session_id: str) -> Tuple[str, Optional[Result]]:
+    """接收一轮回复，状态栏显示进度（思考、工具调用）"""
+    response = ""
+    result: Optional[Result] = None
+    with console.status("[bold green]思考中...[/bold green]") as status:
+        async with aclosing(claude_service.chat_events(message, session_id)) as events:
+            async for event in events:
+                if isinstance(event, TextDelta):
+                    response += event.text
+                    status.update("[bold green]回复中...[/bold green]")
+                elif isinstance(event, ToolUse):
+                    status.update(f"[bold green]调用工具 {event.name}...[/bold green]")
+                elif isinstance(event, Result):
+                    result = event
+                elif isinstance(event, ErrorEvent):
+                    response += f"错误: {event.message}"
+    return response, result
+
+
 async def chat_loop(session_id: str, auto_execute: bool):
     """聊天循环"""
     console.print(Panel(
@@ -79,24 +118,24 @@ async def chat_loop(session_id: str, auto_execute: bool):
                     continue
 
             # 调用 AI
-            with console.status("[bold green]思考中...[/bold green]"):
-                response = await claude_service.chat(user_input, session_id)
+            response, usage = await stream_reply(user_input, session_id)
 
             print_response(response)
+            if usage:
+                print_usage(usage)
 
             # 检查是否有操作需要执行
-            action = executor_service.parse_action(response)
-            if action:
+            actions = executor_service.parse_actions(response)
+            if actions:
                 if auto_execute:
                     console.print("[yellow]正在执行操作...[/yellow]")
-                    result = await executor_service.process_action(action)
-                    print_action_result(result)
+                    await run_actions(actions)
                 else:
-                    console.print(f"\n[yellow]检测到操作: {action.get('action')}[/yellow]")
+                    names = ", ".join(a.get("action", "?") for a in actions)
+                    console.print(f"\n[yellow]检测到 {len(actions)} 个操作: {names}[/yellow]")
                     confirm = Prompt.ask("是否执行？", choices=["y", "n"], default="y")
                     if confirm == "y":
-                        result = await executor_service.process_action(action)
-                        print_action_result(result)
+                        await run_actions(actions)
 
         except KeyboardInterrupt:
             console.print("\n[yellow]按 Ctrl+C 退出，或输入 /exit[/yellow]")
@@ -104,13 +143,22 @@ async def chat_loop(session_id: str, auto_execute: bool):
             print_error(str(e))
 
 
+async def with_service(coro):
+    """启动服务（进程池、会话持久化），结束时写回会话并释放资源"""
+    await claude_service.start()
+    try:
+        await coro
+    finally:
+        await claude_service.stop()
+
+
 @app.command()
 def chat(
     session: str = typer.Option("cli_default", "--session", "-s", help="会话 ID"),
     auto: bool = typer.Option(False, "--auto", "-a", help="自动执行命令")
 ):
     """启动交互式聊天"""
-    asyncio.run(chat_loop(session, auto))
+    asyncio.run(with_service(chat_loop(session, auto)))
 
 
 @app.command()
@@ -124,12 +172,11 @@ def ask(
         response = await claude_service.chat(message, session)
         print_response(response)
 
-        action = executor_service.parse_action(response)
-        if action and execute:
-            result = await executor_service.process_action(action)
-            print_action_result(result)
+        actions = executor_service.parse_actions(response)
+        if actions and execute:
+            await run_actions(actions)
 
-    asyncio.run(run())
+    asyncio.run(with_service(run()))
 
 
 @app.command()
@@ -2,6 +2,7 @@
 
 from pydantic_settings import BaseSettings
 from pydantic import Field
+from functools import cached_property
 from typing import List
 import os
 
@@ -15,24 +16,98 @@ class Settings(BaseSettings):
     feishu_app_secret: str = Field(default="", env="FEISHU_APP_SECRET")
     feishu_verification_token: str = Field(default="", env="FEISHU_VERIFICATION_TOKEN")
     feishu_encrypt_key: str = Field(default="", env="FEISHU_ENCRYPT_KEY")
+    # 消息去重窗口
+    feishu_dedup_ttl: float = Field(default=300.0, env="FEISHU_DEDUP_TTL")
+    feishu_dedup_max_size: int = Field(default=10000, env="FEISHU_DEDUP_MAX_SIZE")
+    # 在 token 过期前多少秒后台续期
+    feishu_token_renew_ahead: float = Field(default=120.0, env="FEISHU_TOKEN_RENEW_AHEAD")
+
+    # 飞书 HTTP 连接池
+    feishu_http2: bool = Field(default=True, env="FEISHU_HTTP2")
+    feishu_http_timeout: float = Field(default=10.0, env="FEISHU_HTTP_TIMEOUT")
+    feishu_http_max_connections: int = Field(default=100, env="FEISHU_HTTP_MAX_CONNECTIONS")
+    feishu_http_max_keepalive: int = Field(default=20, env="FEISHU_HTTP_MAX_KEEPALIVE")
+    feishu_http_keepalive_expiry: float = Field(default=60.0, env="FEISHU_HTTP_KEEPALIVE_EXPIRY")
+    # 飞书 API 限流额度（每秒请求数）
+    feishu_qps: float = Field(default=50.0, env="FEISHU_QPS")
+    feishu_message_qps: float = Field(default=20.0, env="FEISHU_MESSAGE_QPS")
+    feishu_card_qps: float = Field(default=10.0, env="FEISHU_CARD_QPS")
+    # 飞书消息中的操作是否自动执行（输出流式展示在回复卡片中）
+    feishu_auto_execute: bool = Field(default=False, env="FEISHU_AUTO_EXECUTE")
 
     # 服务配置
     host: str = Field(default="0.0.0.0", env="HOST")
     port: int = Field(default=8000, env="PORT")
     debug: bool = Field(default=False, env="DEBUG")
 
+    # 会话存储
+    session_max_count: int = Field(default=1000, env="SESSION_MAX_COUNT")
+    session_idle_ttl: float = Field(default=3600.0, env="SESSION_IDLE_TTL")
+    session_max_bytes: int = Field(default=64 * 1024 * 1024, env="SESSION_MAX_BYTES")
+    # 同一会话排队期间新到的消息是否合并进下一轮
+    session_merge_pending: bool = Field(default=False, env="SESSION_MERGE_PENDING")
+    # 持久化后端: memory / sqlite
+    session_backend: str = Field(default="memory", env="SESSION_BACKEND")
+    session_db_path: str = Field(default="~/.chat_work/sessions.db", env="SESSION_DB_PATH")
+    session_flush_interval: float = Field(default=1.0, env="SESSION_FLUSH_INTERVAL")
+
+    # 回复缓存：会话上下文相同时，相同的问题直接返回之前的回复（默认关闭）
+    response_cache_enabled: bool = Field(default=False, env="RESPONSE_CACHE_ENABLED")
+    response_cache_ttl: float = Field(default=3600.0, env="RESPONSE_CACHE_TTL")
+    response_cache_max_entries: int = Field(default=1000, env="RESPONSE_CACHE_MAX_ENTRIES")
+    # 磁盘层路径，留空则只缓存在内存中
+    response_cache_path: str = Field(default="~/.chat_work/response_cache.db", env="RESPONSE_CACHE_PATH")
+    # 缓存命中时按块回放：每块字符数、块间隔（秒）
+    response_replay_chunk_size: int = Field(default=64, env="RESPONSE_REPLAY_CHUNK_SIZE")
+    response_replay_interval: float = Field(default=0.0, env="RESPONSE_REPLAY_INTERVAL")
+
+    # 准入控制：同时运行的 claude 请求数、最大排队数
+    claude_max_concurrent: int = Field(default=8, env="CLAUDE_MAX_CONCURRENT")
+    claude_max_queue: int = Field(default=50, env="CLAUDE_MAX_QUEUE")
+
+    # Claude CLI 进程池（预热常驻进程，省去每条消息的冷启动）
+    claude_pool_enabled: bool = Field(default=True, env="CLAUDE_POOL_ENABLED")
+    claude_pool_min_size: int = Field(default=2, env="CLAUDE_POOL_MIN_SIZE")
+    claude_pool_max_size: int = Field(default=8, env="CLAUDE_POOL_MAX_SIZE")
+    # 每个进程处理多少次请求后回收；进程只服务同一会话，多轮对话复用进程内上下文
+    claude_pool_max_requests: int = Field(default=20, env="CLAUDE_POOL_MAX_REQUESTS")
+    claude_pool_idle_timeout: float = Field(default=600.0, env="CLAUDE_POOL_IDLE_TIMEOUT")
+    claude_pool_health_interval: float = Field(default=30.0, env="CLAUDE_POOL_HEALTH_INTERVAL")
+
     # 安全配置
     allowed_dirs: str = Field(default="/tmp", env="ALLOWED_DIRS")
     blocked_commands: str = Field(default="rm -rf /,sudo rm,mkfs,dd if=", env="BLOCKED_COMMANDS")
+    # 黑名单的例外规则（命中黑名单但同时命中例外的命令允许执行）
+    allowed_commands: str = Field(default="", env="ALLOWED_COMMANDS")
+    command_timeout: int = Field(default=60, env="COMMAND_TIMEOUT")
+    # 命令资源限制（0 表示不限制），操作中可以用 timeout/cpu_seconds/memory_mb/max_output_bytes 进一步收紧
+    command_cpu_seconds: int = Field(default=60, env="COMMAND_CPU_SECONDS")
+    command_memory_mb: int = Field(default=2048, env="COMMAND_MEMORY_MB")
+    command_max_output_bytes: int = Field(default=10 * 1024 * 1024, env="COMMAND_MAX_OUTPUT_BYTES")
+    command_nice: int = Field(default=10, env="COMMAND_NICE")
+    command_ionice: bool = Field(default=True, env="COMMAND_IONICE")
+    # cgroup v2 目录（需预先创建并有写权限），命令进程启动时加入
+    command_cgroup: str = Field(default="", env="COMMAND_CGROUP")
+    # 读取文件：单次最多返回的字节数（超出截断）、分块大小
+    read_max_bytes: int = Field(default=1024 * 1024, env="READ_MAX_BYTES")
+    read_chunk_size: int = Field(default=64 * 1024, env="READ_CHUNK_SIZE")
+    # edit_file（搜索/替换）需要整文件载入内存，超过该大小请用 patch_file
+    edit_max_bytes: int = Field(default=16 * 1024 * 1024, env="EDIT_MAX_BYTES")
+    # 一次回复中多个操作的最大并发数
+    executor_max_parallel: int = Field(default=4, env="EXECUTOR_MAX_PARALLEL")
 
-    @property
+    @cached_property
     def allowed_dirs_list(self) -> List[str]:
         return [d.strip() for d in self.allowed_dirs.split(",") if d.strip()]
 
-    @property
+    @cached_property
     def blocked_commands_list(self) -> List[str]:
         return [c.strip() for c in self.blocked_commands.split(",") if c.strip()]
 
+    @cached_property
+    def allowed_commands_list(self) -> List[str]:
+        return [c.strip() for c in self.allowed_commands.split(",") if c.strip()]
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
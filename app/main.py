@@ -27,12 +27,27 @@ async def startup_event():
     """启动时初始化"""
     from app.platforms.feishu import feishu_platform
     from app.api.routes import process_feishu_message
-    
+    from app.services import claude_service
+
+    # 预热 claude 进程池、建立飞书连接池
+    await claude_service.start()
+    await feishu_platform.start()
+
     # 后台启动飞书 WebSocket
     import asyncio
     asyncio.create_task(feishu_platform.start_feishu_ws(process_feishu_message))
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """关闭时释放资源"""
+    from app.platforms.feishu import feishu_platform
+    from app.services import claude_service
+
+    await claude_service.stop()
+    await feishu_platform.close()
+
+
 
 @app.get("/")
 async def index():
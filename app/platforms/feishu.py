@@ -1,6 +1,7 @@
 """飞书平台接入 - 支持文本、图片、文件、语音消息 + 伪流式回复 + WebSocket长连接"""
 
 import hashlib
+import importlib.util
 import json
 import httpx
 import os
@@ -9,10 +10,14 @@ import uuid
 import asyncio
 import logging
 import time
+from contextlib import aclosing
 from typing import Optional, Dict, Any, List, AsyncGenerator, Callable
 from pathlib import Path
 
 from app.config import settings
+from app.services.stream_parser import TextDelta, ToolUse, ErrorEvent
+from app.utils.rate_limit import RateLimiter
+from app.utils.ttl_cache import ExpiringSet
 
 # Feishu SDK Imports
 import lark_oapi as lark
@@ -21,6 +26,90 @@ from lark_oapi.ws import Client as WSClient
 
 logger = logging.getLogger(__name__)
 
+# 飞书频控相关错误码（请求过于频繁 / 消息发送频率超限）
+RATE_LIMIT_CODES = {99991400, 230020, 11232}
+
+class CardStreamUpdater:
+    """卡片流式更新器
+
+    生成器只负责写入最新内容，后台任务按 ``interval`` 节奏推送；
+    API 变慢时中间状态直接丢弃，只推送最新内容，失败的更新在下一拍重试。
+    """
+
+    def __init__(
+        self,
+        platform: "FeishuPlatform",
+        card_id: str,
+        element_id: str,
+        interval: float,
+        max_retries: int = 3
+    ):
+        self.platform = platform
+        self.card_id = card_id
+        self.element_id = element_id
+        self.interval = interval
+        self.max_retries = max_retries
+        self._sequence = 1
+        self._latest = ""
+        self._pushed: Optional[str] = None
+        self._dirty = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def update(self, content: str):
+        """记录最新内容（不等待网络）"""
+        self._latest = content
+        self._dirty.set()
+
+    async def _push(self, content: str) -> bool:
+        success = await self.platform.update_card_streaming(
+            self.card_id, self.element_id, content, self._sequence
+        )
+        # 失败时序号也前移，避免重试撞上已被服务端消费的序号
+        self._sequence += 1
+        if success:
+            self._pushed = content
+        return success
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            started = loop.time()
+            content = self._latest
+            if content != self._pushed:
+                # shield：停止节拍时不打断已发出的请求
+                self._inflight = asyncio.create_task(self._push(content))
+                if not await asyncio.shield(self._inflight):
+                    # 下一拍用最新内容重试
+                    self._dirty.set()
+            await asyncio.sleep(max(self.interval - (loop.time() - started), 0))
+
+    async def finish(self):
+        """停止节拍任务，并确保最终内容推送成功"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._inflight and not self._inflight.done():
+            await self._inflight
+
+        for attempt in range(self.max_retries):
+            if self._latest == self._pushed:
+                return
+            if await self._push(self._latest):
+                return
+            await asyncio.sleep(min(self.interval * (2 ** attempt), 5))
+        logger.error(f"Final card update failed after {self.max_retries} attempts: {self.card_id}")
+
+
 class FeishuPlatform:
     """飞书机器人平台"""
 
@@ -31,6 +120,10 @@ class FeishuPlatform:
         self.encrypt_key = settings.feishu_encrypt_key
         self._tenant_access_token: Optional[str] = None
         self._token_expire_time: float = 0
+        # 正在进行的 token 刷新（所有等待者共享同一个请求）
+        self._token_refresh_task: Optional[asyncio.Task] = None
+        # 后台提前续期任务
+        self._token_renew_task: Optional[asyncio.Task] = None
 
         # 临时文件存储目录
         self.temp_dir = Path(tempfile.gettempdir()) / "chat_work_feishu"
@@ -39,29 +132,136 @@ class FeishuPlatform:
         # WebSocket Client
         self.ws_client: Optional[WSClient] = None
 
+        # 消息去重（Webhook 与 WebSocket 共用，防止重复处理）
+        self.processed_messages = ExpiringSet(
+            ttl=settings.feishu_dedup_ttl,
+            max_size=settings.feishu_dedup_max_size
+        )
+
+        # 共享的 HTTP 连接池（复用 TCP/TLS 连接，流式更新不再每次握手）
+        self._http_client: Optional[httpx.AsyncClient] = None
+
+        # 所有出站 API 调用共用的限流调度器（全局 + 分端点额度，卡片间公平轮转）
+        self.rate_limiter = RateLimiter(
+            rate=settings.feishu_qps,
+            endpoint_limits={
+                "message": (settings.feishu_message_qps, settings.feishu_message_qps),
+                "card_create": (settings.feishu_card_qps, settings.feishu_card_qps),
+                "card_update": (settings.feishu_card_qps, settings.feishu_card_qps),
+            }
+        )
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """获取共享的 httpx.AsyncClient（首次使用时创建）"""
+        if self._http_client is None or self._http_client.is_closed:
+            # HTTP/2 依赖可选的 h2 包，未安装时退回 HTTP/1.1
+            http2 = settings.feishu_http2 and importlib.util.find_spec("h2") is not None
+            self._http_client = httpx.AsyncClient(
+                http2=http2,
+                timeout=settings.feishu_http_timeout,
+                limits=httpx.Limits(
+                    max_connections=settings.feishu_http_max_connections,
+                    max_keepalive_connections=settings.feishu_http_max_keepalive,
+                    keepalive_expiry=settings.feishu_http_keepalive_expiry
+                )
+            )
+        return self._http_client
+
+    async def start(self):
+        """初始化连接池并启动 token 后台续期（应用启动时调用）"""
+        _ = self.http_client
+        if self.app_id and self._token_renew_task is None:
+            self._token_renew_task = asyncio.create_task(self._token_renew_loop())
+
+    async def close(self):
+        """停止后台任务并关闭连接池（应用关闭时调用）"""
+        if self._token_renew_task is not None:
+            self._token_renew_task.cancel()
+            self._token_renew_task = None
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+
+    async def _request(self, method: str, url: str, endpoint: str, key: str = "default", **kwargs) -> httpx.Response:
+        """经限流调度器发送请求，遇到频控错误时自适应退避"""
+        await self.rate_limiter.acquire(endpoint, key)
+        response = await self.http_client.request(method, url, **kwargs)
+
+        code = None
+        if response.status_code != 429 and "json" in response.headers.get("content-type", ""):
+            try:
+                code = response.json().get("code")
+            except ValueError:
+                pass
+        if response.status_code == 429 or code in RATE_LIMIT_CODES:
+            try:
+                retry_after = float(response.headers.get("x-ogw-ratelimit-reset", 1))
+            except ValueError:
+                retry_after = 1.0
+            logger.warning(f"Feishu rate limited on {endpoint} (code={code}), backing off {retry_after}s")
+            self.rate_limiter.report_rate_limited(endpoint, retry_after)
+        else:
+            self.rate_limiter.report_success(endpoint)
+        return response
+
     async def get_tenant_access_token(self) -> str:
         """获取 tenant_access_token"""
         # 检查 token 是否过期
         if self._tenant_access_token and time.time() < self._token_expire_time:
             return self._tenant_access_token
 
-        async with httpx.AsyncClient() as client:
+        return await self._refresh_tenant_access_token()
+
+    async def _refresh_tenant_access_token(self) -> str:
+        """刷新 token（single-flight：并发调用只发起一次请求）"""
+        if self._token_refresh_task is None or self._token_refresh_task.done():
+            self._token_refresh_task = asyncio.create_task(self._fetch_tenant_access_token())
+        # shield 避免单个等待者被取消时连带取消共享的刷新请求
+        return await asyncio.shield(self._token_refresh_task)
+
+    async def _fetch_tenant_access_token(self) -> str:
+        """请求新的 tenant_access_token"""
+        try:
+            response = await self._request(
+                "POST",
+                "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal",
+                "auth",
+                json={
+                    "app_id": self.app_id,
+                    "app_secret": self.app_secret
+                }
+            )
+            data = response.json()
+            token = data.get("tenant_access_token")
+            if not token:
+                # 出错时保留原有的 token 和过期时间，续期任务稍后重试
+                logger.error(f"Failed to refresh tenant access token: {data.get('code')} {data.get('msg')}")
+                return ""
+            self._tenant_access_token = token
+            # token 有效期 2 小时，提前 5 分钟刷新
+            self._token_expire_time = time.time() + data.get("expire", 7200) - 300
+            return token
+        except Exception as e:
+            logger.error(f"Failed to refresh tenant access token: {e}")
+            return ""
+
+    async def _token_renew_loop(self):
+        """后台在 token 过期前续期，请求路径上不再等待刷新"""
+        while True:
             try:
-                response = await client.post(
-                    "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal",
-                    json={
-                        "app_id": self.app_id,
-                        "app_secret": self.app_secret
-                    }
-                )
-                data = response.json()
-                self._tenant_access_token = data.get("tenant_access_token")
-                # token 有效期 2 小时，提前 5 分钟刷新
-                self._token_expire_time = time.time() + data.get("expire", 7200) - 300
-                return self._tenant_access_token
+                wait = self._token_expire_time - time.time() - settings.feishu_token_renew_ahead
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                token = await self._refresh_tenant_access_token()
+                if not token:
+                    # 刷新失败，稍后重试
+                    await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                break
             except Exception as e:
-                logger.error(f"Failed to refresh tenant access token: {e}")
-                return ""
+                logger.error(f"Token renew loop error: {e}")
+                await asyncio.sleep(30)
 
     def verify_signature(self, timestamp: str, nonce: str, body: str, signature: str) -> bool:
         """验证飞书请求签名"""
@@ -75,23 +275,26 @@ class FeishuPlatform:
         """下载飞书资源"""
         token = await self.get_tenant_access_token()
         try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.get(
-                    f"https://open.feishu.cn/open-apis/im/v1/messages/{message_id}/resources/{file_key}",
-                    headers={"Authorization": f"Bearer {token}"},
-                    params={"type": resource_type},
-                    follow_redirects=True
-                )
-                if response.status_code == 200:
-                    content_type = response.headers.get("content-type", "")
-                    ext = self._get_extension(content_type, resource_type, filename)
-                    safe_filename = f"{uuid.uuid4().hex}{ext}"
-                    filepath = self.temp_dir / safe_filename
-                    filepath.write_bytes(response.content)
-                    return str(filepath)
-                else:
-                    logger.error(f"Download resource failed: {response.status_code}")
-                    return None
+            response = await self._request(
+                "GET",
+                f"https://open.feishu.cn/open-apis/im/v1/messages/{message_id}/resources/{file_key}",
+                "resource",
+                key=message_id,
+                headers={"Authorization": f"Bearer {token}"},
+                params={"type": resource_type},
+                follow_redirects=True,
+                timeout=60.0
+            )
+            if response.status_code == 200:
+                content_type = response.headers.get("content-type", "")
+                ext = self._get_extension(content_type, resource_type, filename)
+                safe_filename = f"{uuid.uuid4().hex}{ext}"
+                filepath = self.temp_dir / safe_filename
+                filepath.write_bytes(response.content)
+                return str(filepath)
+            else:
+                logger.error(f"Download resource failed: {response.status_code}")
+                return None
         except Exception as e:
             logger.error(f"Download resource exception: {e}")
             return None
@@ -122,37 +325,43 @@ class FeishuPlatform:
         """发送消息"""
         token = await self.get_tenant_access_token()
         content_body = {"text": content} if msg_type == "text" else content
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://open.feishu.cn/open-apis/im/v1/messages",
-                headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
-                params={"receive_id_type": "chat_id"},
-                json={"receive_id": chat_id, "msg_type": msg_type, "content": json.dumps(content_body)}
-            )
-            return response.json()
+        response = await self._request(
+            "POST",
+            "https://open.feishu.cn/open-apis/im/v1/messages",
+            "message",
+            key=chat_id,
+            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+            params={"receive_id_type": "chat_id"},
+            json={"receive_id": chat_id, "msg_type": msg_type, "content": json.dumps(content_body)}
+        )
+        return response.json()
 
     async def reply_message(self, message_id: str, content: Any, msg_type: str = "text") -> Dict:
         """回复消息"""
         token = await self.get_tenant_access_token()
         content_body = {"text": content} if msg_type == "text" else content
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"https://open.feishu.cn/open-apis/im/v1/messages/{message_id}/reply",
-                headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
-                json={"msg_type": msg_type, "content": json.dumps(content_body)}
-            )
-            return response.json()
+        response = await self._request(
+            "POST",
+            f"https://open.feishu.cn/open-apis/im/v1/messages/{message_id}/reply",
+            "message",
+            key=message_id,
+            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+            json={"msg_type": msg_type, "content": json.dumps(content_body)}
+        )
+        return response.json()
 
     async def update_message(self, message_id: str, content: str) -> Dict:
         # Legacy update method (for text messages)
         token = await self.get_tenant_access_token()
-        async with httpx.AsyncClient() as client:
-            response = await client.patch(
-                f"https://open.feishu.cn/open-apis/im/v1/messages/{message_id}",
-                headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
-                json={"msg_type": "text", "content": json.dumps({"text": content})}
-            )
-            return response.json()
+        response = await self._request(
+            "PATCH",
+            f"https://open.feishu.cn/open-apis/im/v1/messages/{message_id}",
+            "message",
+            key=message_id,
+            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+            json={"msg_type": "text", "content": json.dumps({"text": content})}
+        )
+        return response.json()
 
     # ==================== Card V2 & Streaming ====================
 
@@ -161,28 +370,29 @@ class FeishuPlatform:
         token = await self.get_tenant_access_token()
         url = "https://fsopen.bytedance.net/open-apis/cardkit/v1/cards"
         
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(
-                    url,
-                    headers={
-                        "Authorization": f"Bearer {token}",
-                        "Content-Type": "application/json; charset=utf-8"
-                    },
-                    json={
-                        "type": "card_json",
-                        "data": json.dumps(card_json)
-                    }
-                )
-                res_data = response.json()
-                if res_data.get("code") == 0:
-                    return res_data.get("data", {}).get("card_id")
-                else:
-                    logger.error(f"Create card entity failed: {res_data}")
-                    return None
-            except Exception as e:
-                logger.error(f"Error creating card entity: {e}")
+        try:
+            response = await self._request(
+                "POST",
+                url,
+                "card_create",
+                headers={
+                    "Authorization": f"Bearer {token}",
+                    "Content-Type": "application/json; charset=utf-8"
+                },
+                json={
+                    "type": "card_json",
+                    "data": json.dumps(card_json)
+                }
+            )
+            res_data = response.json()
+            if res_data.get("code") == 0:
+                return res_data.get("data", {}).get("card_id")
+            else:
+                logger.error(f"Create card entity failed: {res_data}")
                 return None
+        except Exception as e:
+            logger.error(f"Error creating card entity: {e}")
+            return None
 
     async def update_card_streaming(self, card_id: str, element_id: str, content: str, sequence: int) -> bool:
         """流式更新卡片内容"""
@@ -195,30 +405,49 @@ class FeishuPlatform:
             "content": content
         }
         
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.put(
-                    url,
-                    headers={
-                        "Authorization": f"Bearer {token}",
-                        "Content-Type": "application/json; charset=utf-8"
-                    },
-                    json=body
-                )
-                res_data = response.json()
-                if res_data.get("code") == 0:
-                    return True
-                else:
-                    # Log error code 300309 etc
-                    if res_data.get("code") != 0:
-                        logger.error(f"Update card streaming failed: {res_data}")
-                    return False
-            except Exception as e:
-                logger.error(f"Error updating card streaming: {e}")
+        try:
+            response = await self._request(
+                "PUT",
+                url,
+                "card_update",
+                key=card_id,
+                headers={
+                    "Authorization": f"Bearer {token}",
+                    "Content-Type": "application/json; charset=utf-8"
+                },
+                json=body
+            )
+            res_data = response.json()
+            if res_data.get("code") == 0:
+                return True
+            else:
+                # Log error code 300309 etc
+                if res_data.get("code") != 0:
+                    logger.error(f"Update card streaming failed: {res_data}")
                 return False
-
-    async def reply_stream(self, message_id: str, content_generator: AsyncGenerator[str, None], update_interval: float = 0.1):
-        """流式回复 (Rich Text V2 + Streaming)"""
+        except Exception as e:
+            logger.error(f"Error updating card streaming: {e}")
+            return False
+
+    @staticmethod
+    def _render_stream_item(item: Any) -> str:
+        """把流式内容（文本或类型化事件）转换为卡片上追加的 Markdown"""
+        if isinstance(item, str):
+            return item
+        if isinstance(item, TextDelta):
+            return item.text
+        if isinstance(item, ToolUse):
+            return f"\n\n> 🔧 调用工具 {item.name}\n\n"
+        if isinstance(item, ErrorEvent):
+            return f"错误: {item.message}"
+        # 思考过程、工具输出和统计信息不展示
+        return ""
+
+    async def reply_stream(self, message_id: str, content_generator: AsyncGenerator[Any, None], update_interval: float = 0.1):
+        """流式回复 (Rich Text V2 + Streaming)
+
+        content_generator 可以产出文本，也可以产出 ClaudeService.chat_events 的类型化事件。
+        """
         element_id = "elem_md"
         card_json = {
             "schema": "2.0",
@@ -259,30 +488,27 @@ class FeishuPlatform:
             msg_type="interactive"
         )
         
+        # 独立任务按固定节奏推送最新内容，不阻塞生成器的消费
+        updater = CardStreamUpdater(self, card_id, element_id, update_interval)
+        updater.start()
         full_content = ""
-        sequence = 1
-        last_update_time = 0
-        
+
         try:
-            async for chunk in content_generator:
-                full_content += chunk
-                current_time = time.time()
-                
-                # 按间隔流式更新
-                if current_time - last_update_time >= update_interval:
-                    success = await self.update_card_streaming(card_id, element_id, full_content, sequence)
-                    if success:
-                        sequence += 1
-                        last_update_time = current_time
-                    else:
-                        pass # Ignore retry for now
-
-            # 最终更新
-            await self.update_card_streaming(card_id, element_id, full_content, sequence)
+            # aclosing：出错时立即关闭生成器，释放其背后的 claude 进程
+            async with aclosing(content_generator):
+                async for chunk in content_generator:
+                    text = self._render_stream_item(chunk)
+                    if not text:
+                        continue
+                    full_content += text
+                    updater.update(full_content)
 
         except Exception as e:
             logger.error(f"Streaming exception: {e}", exc_info=True)
             # Try to show error in card if possible, otherwise log
+        finally:
+            # 最终更新（失败会重试）
+            await updater.finish()
 
     # ==================== Event Handling ====================
     
@@ -303,7 +529,11 @@ class FeishuPlatform:
             msg_type = message.get("message_type")
             message_id = message.get("message_id")
             chat_id = message.get("chat_id")
-            
+
+            # 去重：飞书重推或 Webhook 已处理过的消息直接忽略
+            if message_id and not self.processed_messages.add(message_id):
+                return
+
             content_json = json.loads(message.get("content", "{}"))
             text = ""
             
@@ -0,0 +1,76 @@
+"""操作指令解析 - 在流式回复中增量识别 ```json 操作块"""
+
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+# 代码块开头：```json
+_OPEN_FENCE = re.compile(r"```json")
+_FENCE = "```"
+# 开头标记可能被切在两个块之间，未进入代码块时保留的尾部长度
+_OPEN_TAIL = len("```json") - 1
+
+
+class ActionDetector:
+    """增量识别回复中的操作指令
+
+    每收到一块文本调用 feed()，代码块一闭合就返回其中的操作，不必等整段回复结束。
+    JSON 字符串里可以包含反引号：只有当 ``` 之前的内容能解析为完整 JSON
+    时才认为代码块结束；位于行首却仍无法解析的 ``` 视为格式错误的代码块并跳过。
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        # 当前代码块内容的起点，None 表示不在代码块内
+        self._block_start: Optional[int] = None
+        self._scan = 0
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """追加一块文本，返回新闭合的操作块中的操作"""
+        self._buffer += text
+        actions: List[Dict[str, Any]] = []
+        while True:
+            if self._block_start is None:
+                match = _OPEN_FENCE.search(self._buffer, self._scan)
+                if not match:
+                    # 只保留可能是开头标记前缀的尾部
+                    self._buffer = self._buffer[-_OPEN_TAIL:]
+                    self._scan = 0
+                    return actions
+                self._block_start = match.end()
+                self._scan = match.end()
+
+            close = self._buffer.find(_FENCE, self._scan)
+            if close < 0:
+                # ``` 可能被切开，下次从末尾前两个字符继续找
+                self._scan = max(len(self._buffer) - len(_FENCE) + 1, self._block_start)
+                return actions
+
+            content = self._buffer[self._block_start:close].strip()
+            parsed = _load_object(content)
+            at_line_start = self._buffer[self._block_start:close].rstrip(" \t").endswith("\n")
+            if parsed is None and not at_line_start:
+                # 反引号在 JSON 字符串里，继续找真正的结束标记
+                self._scan = close + len(_FENCE)
+                continue
+
+            if parsed is not None and "action" in parsed:
+                actions.append(parsed)
+            self._buffer = self._buffer[close + len(_FENCE):]
+            self._block_start = None
+            self._scan = 0
+
+
+def _load_object(content: str) -> Optional[Dict[str, Any]]:
+    if not content.startswith("{") or not content.endswith("}"):
+        return None
+    try:
+        value = json.loads(content)
+    except json.JSONDecodeError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def find_actions(text: str) -> List[Dict[str, Any]]:
+    """解析完整文本中的全部操作指令"""
+    return ActionDetector().feed(text)
@@ -0,0 +1,201 @@
+"""多操作执行计划 - 按依赖关系并发执行一次回复中的全部操作"""
+
+import asyncio
+import os
+import re
+import time
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from app.utils.command_policy import split_commands
+
+# 输出回调：(操作序号, 输出块)
+OutputCallback = Callable[[int, str], Awaitable[None]]
+# 结果回调：每个操作完成时调用
+ResultCallback = Callable[["ActionResult"], Awaitable[None]]
+
+
+@dataclass
+class ActionResult:
+    """单个操作的执行结果"""
+    index: int
+    action: Dict[str, Any]
+    success: bool = False
+    output: str = ""
+    skipped: bool = False
+    duration_ms: float = 0.0
+    depends_on: List[int] = field(default_factory=list)
+
+
+def _action_path(action: Dict[str, Any]) -> Optional[str]:
+    path = action.get("path")
+    if not path:
+        return None
+    return os.path.abspath(os.path.expanduser(path))
+
+
+# 只读取、不修改文件的命令，可与其他读操作并发执行
+_READ_ONLY_COMMANDS = {
+    "ls", "cat", "head", "tail", "grep", "egrep", "rg", "wc", "pwd", "echo", "stat",
+    "file", "du", "df", "which", "tree", "diff", "date", "whoami", "uname", "ps"
+}
+_READ_ONLY_GIT = {"status", "log", "diff", "show", "blame", "rev-parse", "ls-files"}
+# git branch 带其他参数（新建、删除、重命名）会修改仓库，只有列出分支的选项算只读
+_GIT_BRANCH_LIST_OPTIONS = {"--list", "--all", "--remotes", "--verbose"}
+
+
+def _is_branch_listing(args: List[str]) -> bool:
+    return all(arg in _GIT_BRANCH_LIST_OPTIONS or re.fullmatch(r"-[arv]+", arg) for arg in args)
+
+
+def _is_read_only(command: str) -> bool:
+    """命令中的每个简单命令都是只读的（不含重定向写文件）"""
+    if ">" in command:
+        return False
+    segments = split_commands(command)
+    if not segments:
+        return False
+    for segment in segments:
+        tokens = segment.split(" ")
+        if tokens[0] == "git":
+            if len(tokens) < 2:
+                return False
+            if tokens[1] == "branch":
+                if not _is_branch_listing(tokens[2:]):
+                    return False
+            elif tokens[1] not in _READ_ONLY_GIT:
+                return False
+        elif tokens[0] not in _READ_ONLY_COMMANDS:
+            return False
+    return True
+
+
+def _kind(action: Dict[str, Any]) -> str:
+    """操作的调度类别：read（可并发）、write（按路径排序）、command（副作用未知）、parallel（不参与排序）"""
+    name = action.get("action")
+    if name == "execute":
+        if action.get("parallel"):
+            return "parallel"
+        return "read" if _is_read_only(action.get("command") or "") else "command"
+    return "read" if name == "read_file" else "write"
+
+
+class ActionPlan:
+    """按依赖关系调度操作，最多 max_parallel 个同时执行
+
+    操作可以逐个 add()（例如回复还在流式输出时），每个操作只依赖排在它前面的操作：
+    - 读写同一路径：写在读/写之后，读在写之后
+    - 显式的 ``"depends_on": [序号, ...]``（从 0 开始）
+    - 命令：``ls``、``git status`` 之类的只读命令按读操作处理；其他命令副作用未知，
+      与前后的操作保持顺序；``"parallel": true`` 的命令不参与排序
+
+    前两种是数据依赖，依赖的操作失败时跳过该操作；命令带来的只是顺序约束，
+    前面的命令失败（例如 grep 没有匹配）不影响后面的操作。
+    """
+
+    def __init__(
+        self,
+        executor,
+        max_parallel: int = 4,
+        on_output: Optional[OutputCallback] = None,
+        on_result: Optional[ResultCallback] = None
+    ):
+        self.executor = executor
+        self.on_output = on_output
+        self.on_result = on_result
+        self._semaphore = asyncio.Semaphore(max(max_parallel, 1))
+        self._actions: List[Dict[str, Any]] = []
+        self._kinds: List[str] = []
+        self._tasks: List[asyncio.Task] = []
+
+    def _dependencies(self, action: Dict[str, Any], kind: str) -> Tuple[Set[int], Set[int]]:
+        """返回 (数据依赖, 仅顺序依赖)"""
+        required: Set[int] = set()
+        ordered: Set[int] = set()
+        count = len(self._actions)
+
+        explicit = action.get("depends_on") or []
+        if isinstance(explicit, int):
+            explicit = [explicit]
+        required.update(i for i in explicit if isinstance(i, int) and 0 <= i < count)
+
+        if kind == "parallel":
+            return required, ordered
+
+        path = _action_path(action)
+        for i, (earlier, earlier_kind) in enumerate(zip(self._actions, self._kinds)):
+            if earlier_kind == "parallel":
+                continue
+            if kind == "command" or earlier_kind == "command":
+                ordered.add(i)
+            elif path and _action_path(earlier) == path and "write" in (kind, earlier_kind):
+                required.add(i)
+            elif earlier_kind == "write" and not path:
+                # 只读命令不知道读哪些文件，等之前的写操作完成
+                ordered.add(i)
+            elif kind == "write" and not _action_path(earlier):
+                # 写操作等之前的只读命令读完
+                ordered.add(i)
+        return required, ordered - required
+
+    def add(self, action: Dict[str, Any]) -> int:
+        """加入一个操作并立即开始调度，返回其序号"""
+        index = len(self._actions)
+        kind = _kind(action)
+        required, ordered = self._dependencies(action, kind)
+        self._actions.append(action)
+        self._kinds.append(kind)
+        self._tasks.append(asyncio.create_task(self._run(index, action, required, ordered)))
+        return index
+
+    async def _run(
+        self,
+        index: int,
+        action: Dict[str, Any],
+        required: Set[int],
+        ordered: Set[int]
+    ) -> ActionResult:
+        deps = sorted(required | ordered)
+        result = ActionResult(index=index, action=action, depends_on=deps)
+        results = await asyncio.gather(*(self._tasks[i] for i in deps))
+        failed = [r.index for r in results if r.index in required and not r.success]
+        if failed:
+            result.skipped = True
+            result.output = f"跳过：依赖的操作 #{failed[0] + 1} 未成功"
+        else:
+            async with self._semaphore:
+                started = time.monotonic()
+                parts: List[str] = []
+                try:
+                    async with aclosing(self.executor.process_action_stream(action)) as chunks:
+                        async for chunk in chunks:
+                            parts.append(chunk)
+                            if self.on_output:
+                                await self.on_output(index, chunk)
+                except Exception as e:
+                    parts.append(f"\n❌ 执行错误: {str(e)}")
+                result.duration_ms = (time.monotonic() - started) * 1000
+            result.output = "".join(parts)
+            # 最后一块为执行状态
+            result.success = bool(parts) and parts[-1].lstrip().startswith("✅")
+        if self.on_result:
+            await self.on_result(result)
+        return result
+
+    async def wait(self) -> List[ActionResult]:
+        """等待全部操作完成，按加入顺序返回结果"""
+        return list(await asyncio.gather(*self._tasks))
+
+    async def cancel(self):
+        """取消尚未完成的操作（进行中的命令会被杀掉）"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def format_results(results: List[ActionResult]) -> str:
+    """把多个操作的结果合并为一段文本"""
+    if len(results) == 1:
+        return results[0].output
+    return "\n\n".join(f"[{r.index + 1}/{len(results)}] {r.output}" for r in results)
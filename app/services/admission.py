@@ -0,0 +1,82 @@
+"""准入控制 - 全局限制同时运行的 claude 进程数"""
+
+import asyncio
+import heapq
+import itertools
+from contextlib import asynccontextmanager
+from typing import Dict, List, Tuple
+
+# 优先级：数值越小越优先
+PRIORITY_INTERACTIVE = 0  # WebSocket / REST / CLI，用户在等
+PRIORITY_BACKGROUND = 1   # 飞书等后台消息
+
+
+class ServerBusyError(Exception):
+    """排队已满，拒绝新请求"""
+
+
+class AdmissionController:
+    """带优先级的全局并发限制
+
+    最多 max_concurrent 个请求同时运行，其余按（优先级, 到达顺序）排队；
+    排队数达到 max_queue 时直接拒绝。
+    """
+
+    def __init__(self, max_concurrent: int = 8, max_queue: int = 100):
+        self.max_concurrent = max(max_concurrent, 1)
+        self.max_queue = max_queue
+        self.active = 0
+        self.rejected = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, f in self._waiters if not f.done())
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+        }
+
+    async def _acquire(self, priority: int):
+        # 有名额时一定没有存活的等待者（_release 总是优先转交名额）
+        if self.active < self.max_concurrent:
+            self.active += 1
+            return
+
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise ServerBusyError("服务繁忙，请稍后再试")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        try:
+            # 名额由 _release 直接转交，active 已计入
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 刚拿到名额就被取消，交给下一个
+                self._release()
+            raise
+
+    def _release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_INTERACTIVE):
+        """占用一个运行名额"""
+        await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._release()
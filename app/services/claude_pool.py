@@ -0,0 +1,320 @@
+"""Claude CLI 进程池 - 预热常驻的 claude 进程，消除每条消息的冷启动开销
+
+worker 以 stream-json 输入模式启动（``-p --input-format stream-json``），
+Node 启动、鉴权、配置加载都在进程空闲时完成；请求到来时只需往 stdin 写一行
+用户消息，再从 stdout 读取事件直到 ``result``。
+
+同一进程内的多轮消息共享上下文，所以进程一旦处理过某个会话的请求，
+就只会再分配给同一个会话（会话亲和），达到 ``max_requests`` 后回收。
+已有 CLI 会话但没有亲和进程时（进程被回收、服务重启），新进程以
+``--resume`` 启动，从 CLI 自己保存的上下文继续。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Dict, Any, List, Optional
+
+from app.services.stream_parser import LineReader, parse_line
+from app.utils.process import kill_process_group
+
+logger = logging.getLogger(__name__)
+
+# 保留的 stderr 末尾字节数（进程异常退出时用于报错）
+STDERR_TAIL_BYTES = 16 * 1024
+
+
+class ClaudeWorker:
+    """单个常驻的 claude CLI 进程"""
+
+    def __init__(self, claude_path: str):
+        self.claude_path = claude_path
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.lines: Optional[LineReader] = None
+        self._stderr_tail = bytearray()
+        self._stderr_task: Optional[asyncio.Task] = None
+        self.session_id: Optional[str] = None
+        self.requests_served = 0
+        self.busy = False
+        self.created_at = time.time()
+        self.last_used = self.created_at
+
+    async def start(self, resume: Optional[str] = None):
+        """启动进程，等待 stdin 输入"""
+        args = [
+            self.claude_path,
+            "-p",
+            "--input-format", "stream-json",
+            "--output-format", "stream-json",
+            "--include-partial-messages",
+            "--verbose",
+        ]
+        if resume:
+            args.extend(["--resume", resume])
+        self.process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env={**os.environ, "NO_COLOR": "1"},
+            start_new_session=True
+        )
+        self.lines = LineReader(self.process.stdout)
+        self._stderr_task = asyncio.create_task(self._drain_stderr())
+
+    async def _drain_stderr(self):
+        """持续读取 stderr：常驻进程的 --verbose 输出填满管道后进程会阻塞，只保留末尾一段"""
+        while chunk := await self.process.stderr.read(64 * 1024):
+            self._stderr_tail += chunk
+            del self._stderr_tail[:-STDERR_TAIL_BYTES]
+
+    @property
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def send(self, message: str):
+        """写入一条用户消息"""
+        payload = {
+            "type": "user",
+            "message": {
+                "role": "user",
+                "content": [{"type": "text", "text": message}]
+            }
+        }
+        self.process.stdin.write((json.dumps(payload, ensure_ascii=False) + "\n").encode())
+        await self.process.stdin.drain()
+
+    async def events(self) -> AsyncGenerator[Dict[str, Any], None]:
+        """读取本轮输出事件，直到 result 事件为止"""
+        while True:
+            line = await self.lines.readline()
+            if line is None:
+                return
+            data = parse_line(line)
+            if data is None or data.get("type") == "raw":
+                continue
+            yield data
+            if data.get("type") == "result":
+                return
+
+    async def read_stderr(self) -> str:
+        """进程退出后读取错误输出（末尾部分）"""
+        if self.process is None or self.is_alive:
+            return ""
+        if self._stderr_task:
+            try:
+                await self._stderr_task
+            except Exception:
+                pass
+        return self._stderr_tail.decode(errors="replace")
+
+    async def kill(self):
+        """立即杀掉进程组（取消进行中的请求）"""
+        await kill_process_group(self.process)
+
+    async def close(self):
+        """关闭进程"""
+        if not self.is_alive:
+            return
+        try:
+            self.process.stdin.close()
+            await asyncio.wait_for(self.process.wait(), timeout=2)
+        except (asyncio.TimeoutError, Exception):
+            await self.kill()
+
+
+class ClaudeWorkerPool:
+    """claude 常驻进程池：最小/最大容量、健康检查、按请求数回收"""
+
+    def __init__(
+        self,
+        claude_path: str,
+        min_size: int = 2,
+        max_size: int = 8,
+        max_requests: int = 1,
+        idle_timeout: float = 600.0,
+        health_interval: float = 30.0
+    ):
+        self.claude_path = claude_path
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.max_requests = max(max_requests, 1)
+        self.idle_timeout = idle_timeout
+        self.health_interval = health_interval
+
+        self._workers: List[ClaudeWorker] = []
+        self._spawning = 0
+        self._cond = asyncio.Condition()
+        self._health_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    @property
+    def size(self) -> int:
+        return len(self._workers) + self._spawning
+
+    def stats(self) -> Dict[str, int]:
+        """池状态"""
+        busy = sum(1 for w in self._workers if w.busy)
+        return {"total": len(self._workers), "busy": busy, "idle": len(self._workers) - busy}
+
+    async def start(self):
+        """预热 min_size 个进程并启动健康检查"""
+        self._closed = False
+        await self._replenish()
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop(self):
+        """关闭所有进程"""
+        self._closed = True
+        if self._health_task:
+            self._health_task.cancel()
+            self._health_task = None
+        workers, self._workers = self._workers, []
+        await asyncio.gather(*(w.close() for w in workers), return_exceptions=True)
+
+    async def _spawn(self, busy: bool = False, resume: Optional[str] = None) -> Optional[ClaudeWorker]:
+        """启动一个新进程（调用方已预留 _spawning 名额）"""
+        worker = ClaudeWorker(self.claude_path)
+        worker.busy = busy
+        try:
+            await worker.start(resume)
+        except Exception as e:
+            logger.error(f"Failed to spawn claude worker: {e}")
+            worker = None
+        async with self._cond:
+            self._spawning -= 1
+            if worker and not self._closed:
+                self._workers.append(worker)
+            self._cond.notify_all()
+        if worker and self._closed:
+            await worker.close()
+            return None
+        return worker
+
+    async def _replenish(self):
+        """补足到 min_size 个空闲可用进程"""
+        async with self._cond:
+            fresh = sum(1 for w in self._workers if w.session_id is None and not w.busy)
+            missing = min(self.min_size - fresh - self._spawning, self.max_size - self.size)
+            if missing <= 0 or self._closed:
+                return
+            self._spawning += missing
+        await asyncio.gather(*(self._spawn() for _ in range(missing)))
+
+    async def _retire(self, worker: ClaudeWorker, force: bool = False):
+        """移出并关闭进程，然后补位；force 时不等待进程自行退出"""
+        async with self._cond:
+            if worker in self._workers:
+                self._workers.remove(worker)
+            self._cond.notify_all()
+        if force:
+            await worker.kill()
+        else:
+            await worker.close()
+        if not self._closed:
+            asyncio.create_task(self._replenish())
+
+    def _pick(self, session_id: str, resume: Optional[str]) -> Optional[ClaudeWorker]:
+        """优先选同会话的空闲进程；需要恢复 CLI 会话时不能用未绑定的新进程"""
+        fallback = None
+        for worker in self._workers:
+            if worker.busy or not worker.is_alive:
+                continue
+            if worker.session_id == session_id:
+                return worker
+            if worker.session_id is None and fallback is None and not resume:
+                fallback = worker
+        return fallback
+
+    async def _acquire(self, session_id: str, resume: Optional[str]) -> ClaudeWorker:
+        async with self._cond:
+            while True:
+                worker = self._pick(session_id, resume)
+                if worker:
+                    worker.busy = True
+                    return worker
+                if self.size < self.max_size:
+                    self._spawning += 1
+                    break
+                # 满员时回收一个其他会话的空闲进程腾出名额
+                idle = [w for w in self._workers if not w.busy]
+                if idle:
+                    victim = min(idle, key=lambda w: w.last_used)
+                    self._workers.remove(victim)
+                    asyncio.create_task(victim.close())
+                    continue
+                await self._cond.wait()
+
+        worker = await self._spawn(busy=True, resume=resume)
+        if worker is None:
+            raise RuntimeError("无法启动 claude 进程")
+        return worker
+
+    async def _release(self, worker: ClaudeWorker, healthy: bool):
+        worker.requests_served += 1
+        worker.last_used = time.time()
+        if not healthy or not worker.is_alive:
+            # 本轮被中断（取消、超时、断开），进程里可能还在生成，直接杀掉
+            await self._retire(worker, force=True)
+            return
+        if worker.requests_served >= self.max_requests:
+            await self._retire(worker)
+            return
+        async with self._cond:
+            worker.busy = False
+            self._cond.notify_all()
+
+    async def release_session(self, session_id: str):
+        """会话被清除：回收与之绑定的空闲进程（其中保存着旧上下文）"""
+        async with self._cond:
+            stale = [w for w in self._workers if w.session_id == session_id and not w.busy]
+            for worker in stale:
+                self._workers.remove(worker)
+            for worker in self._workers:
+                if worker.session_id == session_id:
+                    # 正在处理中的进程用完即回收
+                    worker.requests_served = self.max_requests
+            self._cond.notify_all()
+        await asyncio.gather(*(w.close() for w in stale), return_exceptions=True)
+
+    @asynccontextmanager
+    async def acquire(self, session_id: str, resume: Optional[str] = None):
+        """借出一个进程处理一轮对话；resume 为该会话已有的 CLI 会话 ID"""
+        worker = await self._acquire(session_id, resume)
+        worker.session_id = session_id
+        # 预热的新进程被拿走后，后台补位
+        asyncio.create_task(self._replenish())
+        healthy = False
+        try:
+            yield worker
+            healthy = True
+        finally:
+            await self._release(worker, healthy)
+
+    async def _health_loop(self):
+        """定期清理死进程、回收长时间空闲的进程并补足最小容量"""
+        while not self._closed:
+            try:
+                await asyncio.sleep(self.health_interval)
+                now = time.time()
+                stale = []
+                async with self._cond:
+                    for worker in list(self._workers):
+                        if worker.busy:
+                            continue
+                        if not worker.is_alive:
+                            self._workers.remove(worker)
+                        elif worker.session_id and now - worker.last_used > self.idle_timeout:
+                            self._workers.remove(worker)
+                            stale.append(worker)
+                    self._cond.notify_all()
+                await asyncio.gather(*(w.close() for w in stale), return_exceptions=True)
+                await self._replenish()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Claude pool health check failed: {e}")
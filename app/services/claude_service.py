@@ -1,19 +1,92 @@
 """Claude CLI 服务 - 通过跨进程调用本地 claude，支持流式输出"""
 
-import subprocess
 import json
 import asyncio
 import os
-from typing import AsyncGenerator, Optional, List, Dict, Any
+from contextlib import aclosing
+from typing import AsyncGenerator, Optional, List, Dict, Any, Set
+
+from app.config import settings
+from app.services.admission import AdmissionController, PRIORITY_INTERACTIVE
+from app.services.claude_pool import ClaudeWorkerPool
+from app.services.metrics import RequestRecord, UsageStats
+from app.services.response_cache import ResponseCache, replay
+from app.services.session_backend import create_backend
+from app.services.session_queue import SessionTurnQueue
+from app.services.session_store import SessionStore
+from app.services.stream_parser import (
+    LineReader, StreamEventParser, parse_line, TextDelta, ToolUse, Result, ErrorEvent
+)
+from app.utils.process import kill_process_group
+
+# 消息在排队期间被合并到前一轮时返回的提示
+MERGED_NOTICE = "（该消息已与之前的消息合并回复）"
+# 请求被取消时返回的提示
+CANCELLED_NOTICE = "（已取消）"
 
 
 class ClaudeService:
     """通过调用本地 claude CLI 来实现 AI 对话"""
 
     def __init__(self):
-        self.conversations: Dict[str, List[Dict[str, str]]] = {}
+        # 有界会话表：LRU + 空闲 TTL 淘汰
+        self.conversations = SessionStore(
+            max_sessions=settings.session_max_count,
+            idle_ttl=settings.session_idle_ttl,
+            max_bytes=settings.session_max_bytes,
+            max_messages=20,  # 保留最近 20 条消息
+            backend=create_backend(settings.session_backend, settings.session_db_path),
+            flush_interval=settings.session_flush_interval
+        )
+        # 全局限制同时运行的 claude 进程数
+        self.admission = AdmissionController(
+            max_concurrent=settings.claude_max_concurrent,
+            max_queue=settings.claude_max_queue
+        )
+        # 同一会话的请求按顺序逐轮处理
+        self.turns = SessionTurnQueue(merge=settings.session_merge_pending)
+        # 正在运行的 claude 进程（按会话），用于取消
+        self._running: Dict[str, asyncio.subprocess.Process] = {}
+        self._cancelled: Set[str] = set()
+        # 命中缓存、CLI 会话还没见过的消息，下一轮调用 claude 时补进提示
+        self._unsynced: Dict[str, List[Dict[str, str]]] = {}
+        # 每次请求的延迟与 token 用量
+        self.usage = UsageStats()
         # 获取 claude 命令的完整路径
         self.claude_path = self._find_claude_path()
+        # 相同上下文中相同问题的回复缓存（可选）
+        self.response_cache: Optional[ResponseCache] = None
+        if settings.response_cache_enabled:
+            self.response_cache = ResponseCache(
+                ttl=settings.response_cache_ttl,
+                max_entries=settings.response_cache_max_entries,
+                path=settings.response_cache_path or None
+            )
+        # 预热的常驻进程池
+        self.pool: Optional[ClaudeWorkerPool] = None
+        if settings.claude_pool_enabled:
+            self.pool = ClaudeWorkerPool(
+                self.claude_path,
+                min_size=settings.claude_pool_min_size,
+                max_size=settings.claude_pool_max_size,
+                max_requests=settings.claude_pool_max_requests,
+                idle_timeout=settings.claude_pool_idle_timeout,
+                health_interval=settings.claude_pool_health_interval
+            )
+
+    async def start(self):
+        """启动进程池和会话写回（应用启动时调用）"""
+        await self.conversations.start()
+        if self.pool:
+            await self.pool.start()
+
+    async def stop(self):
+        """关闭进程池并写回会话（应用关闭时调用）"""
+        if self.pool:
+            await self.pool.stop()
+        await self.conversations.stop()
+        if self.response_cache:
+            self.response_cache.close()
 
     def _find_claude_path(self) -> str:
         """查找 claude 命令路径"""
@@ -34,53 +107,174 @@ class ClaudeService:
 
     def get_conversation(self, session_id: str) -> List[Dict[str, str]]:
         """获取会话历史"""
-        if session_id not in self.conversations:
-            self.conversations[session_id] = []
-        return self.conversations[session_id]
+        return self.conversations.get(session_id)
 
     def add_message(self, session_id: str, role: str, content: str):
         """添加消息到会话"""
-        conversation = self.get_conversation(session_id)
-        conversation.append({"role": role, "content": content})
-        # 保留最近 20 条消息
-        if len(conversation) > 20:
-            self.conversations[session_id] = conversation[-20:]
+        self.conversations.append(session_id, {"role": role, "content": content})
 
     def clear_conversation(self, session_id: str):
-        """清除会话历史"""
-        self.conversations[session_id] = []
+        """清除会话历史（同时丢弃对应的 CLI 会话和绑定的常驻进程）"""
+        self.conversations.clear(session_id)
+        self._unsynced.pop(session_id, None)
+        if self.pool:
+            asyncio.ensure_future(self.pool.release_session(session_id))
+
+    def stats(self) -> Dict[str, Any]:
+        """服务运行指标"""
+        result: Dict[str, Any] = {"sessions": self.conversations.stats()}
+        result["turns"] = self.turns.stats()
+        result["admission"] = self.admission.stats()
+        result["usage"] = self.usage.summary()
+        if self.pool:
+            result["pool"] = self.pool.stats()
+        if self.response_cache:
+            result["response_cache"] = self.response_cache.stats()
+        return result
+
+    async def cancel(self, session_id: str) -> bool:
+        """取消会话正在进行的请求：杀掉对应 claude 进程组并释放名额"""
+        process = self._running.get(session_id)
+        if process is None or process.returncode is not None:
+            return False
+        self._cancelled.add(session_id)
+        await kill_process_group(process)
+        return True
+
+    def _was_cancelled(self, session_id: str) -> bool:
+        """本轮是否被 cancel() 中止（读取后清除标记）"""
+        if session_id in self._cancelled:
+            self._cancelled.discard(session_id)
+            return True
+        return False
+
+    def queue_position(self, session_id: str) -> int:
+        """该会话的新消息前面还有几轮在处理或排队"""
+        return self.turns.position(session_id)
+
+    def _cache_key(self, message: str, session_id: str, context: Optional[str]) -> Optional[str]:
+        """本轮可缓存时返回缓存键
+
+        键包含会话历史，只有之前的对话完全相同时才会命中；历史已被截断时
+        更早的上下文只在 CLI 会话里，无法判断是否相同，不缓存。
+        """
+        if not self.response_cache:
+            return None
+        history = self.get_conversation(session_id)
+        if len(history) >= self.conversations.max_messages:
+            return None
+        return ResponseCache.make_key(message, context, {"claude": self.claude_path}, history)
+
+    async def _cached_reply(self, message: str, session_id: str, cache_key: Optional[str]) -> Optional[str]:
+        """命中缓存时直接记入会话历史并返回回复"""
+        if not cache_key:
+            return None
+        response = await self.response_cache.get(cache_key)
+        if response is not None:
+            exchange = [{"role": "user", "content": message}, {"role": "assistant", "content": response}]
+            for item in exchange:
+                self.add_message(session_id, item["role"], item["content"])
+            if self.conversations.get_cli_session(session_id):
+                self._unsynced.setdefault(session_id, []).extend(exchange)
+        return response
+
+    def _prompt(self, message: str, session_id: str, context: Optional[str]) -> str:
+        """本轮发给 claude 的完整提示
+
+        CLI 会话没见过的历史（命中缓存的轮次，或 CLI 会话已失效时的全部历史）以对话记录的形式补在前面。
+        """
+        unsynced = self._unsynced.pop(session_id, [])
+        if not self.conversations.get_cli_session(session_id):
+            unsynced = list(self.get_conversation(session_id))
+
+        full_message = message
+        if context:
+            full_message = f"[上下文: {context}]\n\n{message}"
+        if unsynced:
+            transcript = "\n\n".join(
+                f"{'用户' if m['role'] == 'user' else '助手'}: {m['content']}" for m in unsynced
+            )
+            full_message = f"[之前的对话]\n{transcript}\n\n[当前消息]\n{full_message}"
+        return full_message
+
+    async def _store_reply(self, cache_key: Optional[str], response: str, tool_calls: int):
+        """缓存成功的回复；调用过工具的回复依赖当时的环境，不缓存"""
+        if cache_key and response and not tool_calls:
+            await self.response_cache.put(cache_key, response)
 
     async def chat(
         self,
         message: str,
         session_id: str = "default",
-        context: Optional[str] = None
+        context: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        use_cache: bool = True
+    ) -> str:
+        """发送消息并获取回复 - 调用本地 claude CLI
+
+        排队已满时抛出 ServerBusyError；use_cache=False 跳过回复缓存。
+        """
+
+        async with self.turns.turn(session_id, message) as turn:
+            if turn.merged:
+                return MERGED_NOTICE
+            await self.conversations.load(session_id)
+            cache_key = self._cache_key(turn.message, session_id, context) if use_cache else None
+            cached = await self._cached_reply(turn.message, session_id, cache_key)
+            if cached is not None:
+                return cached
+            async with self.admission.slot(priority):
+                return await self._chat_turn(turn.message, session_id, context, cache_key)
+
+    async def _chat_turn(
+        self,
+        message: str,
+        session_id: str,
+        context: Optional[str] = None,
+        cache_key: Optional[str] = None
     ) -> str:
-        """发送消息并获取回复 - 调用本地 claude CLI"""
+        """处理一轮非流式对话（调用方已持有该会话的轮次）"""
 
+        self._cancelled.discard(session_id)
+        full_message = self._prompt(message, session_id, context)
         self.add_message(session_id, "user", message)
 
-        full_message = message
-        if context:
-            full_message = f"[上下文: {context}]\n\n{message}"
+        record = self.usage.start(session_id)
+        if self.pool:
+            try:
+                return await self._chat_pooled(full_message, session_id, record, cache_key)
+            finally:
+                self.usage.finish(record)
 
         try:
-            # 调用 claude CLI，使用 JSON 输出
+            # 调用 claude CLI，使用 JSON 输出；已有 CLI 会话时 --resume 复用其上下文
+            args = [self.claude_path, "-p", full_message, "--output-format", "json"]
+            resume = self.conversations.get_cli_session(session_id)
+            if resume:
+                args.extend(["--resume", resume])
+
             process = await asyncio.create_subprocess_exec(
-                self.claude_path,
-                "-p", full_message,
-                "--output-format", "json",
+                *args,
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE,
-                env={**os.environ, "NO_COLOR": "1"}
+                env={**os.environ, "NO_COLOR": "1"},
+                start_new_session=True
             )
+            self._running[session_id] = process
 
             stdout, stderr = await asyncio.wait_for(
                 process.communicate(),
                 timeout=300  # 5分钟超时
             )
 
+            if self._was_cancelled(session_id):
+                return CANCELLED_NOTICE
+
             if process.returncode != 0:
+                record.error = True
+                if resume:
+                    # CLI 会话可能已失效，下一轮重新开始
+                    self.conversations.set_cli_session(session_id, None)
                 error_msg = stderr.decode() if stderr else "未知错误"
                 return f"Claude CLI 错误: {error_msg}"
 
@@ -88,6 +282,15 @@ class ClaudeService:
             try:
                 result = json.loads(stdout.decode())
                 response = result.get("result", stdout.decode().strip())
+                if result.get("session_id"):
+                    self.conversations.set_cli_session(session_id, result["session_id"])
+                self.usage.apply_usage(
+                    record, result.get("usage") or {}, result.get("total_cost_usd", result.get("cost_usd"))
+                )
+                # JSON 输出不含工具调用明细，多于一轮即说明调用过工具
+                record.tool_calls = max((result.get("num_turns") or 1) - 1, 0)
+                if not result.get("is_error"):
+                    await self._store_reply(cache_key, response, record.tool_calls)
             except json.JSONDecodeError:
                 response = stdout.decode().strip()
 
@@ -95,155 +298,277 @@ class ClaudeService:
             return response
 
         except asyncio.TimeoutError:
+            record.error = True
             return "请求超时（超过5分钟）"
         except FileNotFoundError:
+            record.error = True
             return "错误: 找不到 claude 命令，请确保 Claude Code CLI 已安装"
         except Exception as e:
+            record.error = True
             return f"调用 Claude 失败: {str(e)}"
+        finally:
+            self.usage.finish(record)
+            # 超时、取消或出错时不留下孤儿进程
+            process = self._running.pop(session_id, None)
+            await kill_process_group(process)
+
+    async def chat_events(
+        self,
+        message: str,
+        session_id: str = "default",
+        context: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        use_cache: bool = True
+    ) -> AsyncGenerator[Any, None]:
+        """流式对话的事件接口
+
+        产出 TextDelta / ThinkingDelta / ToolUse / ToolResult / Result / ErrorEvent，
+        排队已满时抛出 ServerBusyError；use_cache=False 跳过回复缓存。
+        """
+
+        async with self.turns.turn(session_id, message) as turn:
+            if turn.merged:
+                yield TextDelta(MERGED_NOTICE)
+                return
+            await self.conversations.load(session_id)
+            cache_key = self._cache_key(turn.message, session_id, context) if use_cache else None
+            cached = await self._cached_reply(turn.message, session_id, cache_key)
+            if cached is not None:
+                chunks = replay(
+                    cached,
+                    chunk_size=settings.response_replay_chunk_size,
+                    interval=settings.response_replay_interval
+                )
+                async with aclosing(chunks):
+                    async for chunk in chunks:
+                        yield TextDelta(chunk)
+                return
+            async with self.admission.slot(priority):
+                turn_events = self._chat_events_turn(turn.message, session_id, context, cache_key)
+                async with aclosing(turn_events) as events:
+                    async for event in events:
+                        yield event
 
     async def chat_stream(
         self,
         message: str,
         session_id: str = "default",
-        context: Optional[str] = None
+        context: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        use_cache: bool = True
     ) -> AsyncGenerator[str, None]:
-        """流式发送消息 - 调用本地 claude CLI 的流式输出"""
+        """流式发送消息，只产出文本
 
-        self.add_message(session_id, "user", message)
-
-        full_message = message
-        if context:
-            full_message = f"[上下文: {context}]\n\n{message}"
-
-        try:
-            # 使用 stream-json 格式获取流式输出
-            process = await asyncio.create_subprocess_exec(
-                self.claude_path,
-                "-p", full_message,
-                "--output-format", "stream-json",
-                "--include-partial-messages",
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                env={**os.environ, "NO_COLOR": "1"}
-            )
+        排队已满时抛出 ServerBusyError。
+        """
 
-            full_response = ""
-            buffer = ""
+        async with aclosing(self.chat_events(message, session_id, context, priority, use_cache)) as events:
+            async for event in events:
+                if isinstance(event, TextDelta):
+                    yield event.text
+                elif isinstance(event, ErrorEvent):
+                    yield f"错误: {event.message}"
 
-            # 逐行读取 JSON 流
-            while True:
-                line = await process.stdout.readline()
-                if not line:
-                    break
+    async def _chat_events_turn(
+        self,
+        message: str,
+        session_id: str,
+        context: Optional[str] = None,
+        cache_key: Optional[str] = None
+    ) -> AsyncGenerator[Any, None]:
+        """处理一轮流式对话（调用方已持有该会话的轮次）"""
 
-                try:
-                    data = json.loads(line.decode().strip())
-
-                    # 处理不同类型的消息
-                    msg_type = data.get("type")
-
-                    if msg_type == "assistant":
-                        # 完整的助手消息
-                        content = data.get("message", {}).get("content", [])
-                        for block in content:
-                            if block.get("type") == "text":
-                                text = block.get("text", "")
-                                # 只输出新增的部分
-                                if text.startswith(full_response):
-                                    new_text = text[len(full_response):]
-                                    if new_text:
-                                        yield new_text
-                                        full_response = text
-                                else:
-                                    # 全新的文本
-                                    yield text
-                                    full_response = text
-
-                    elif msg_type == "content_block_delta":
-                        # 增量文本
-                        delta = data.get("delta", {})
-                        if delta.get("type") == "text_delta":
-                            text = delta.get("text", "")
-                            yield text
-                            full_response += text
-
-                    elif msg_type == "result":
-                        # 最终结果
-                        result_text = data.get("result", "")
-                        if result_text and not full_response:
-                            yield result_text
-                            full_response = result_text
-
-                except json.JSONDecodeError:
-                    # 非 JSON 行，直接输出
-                    text = line.decode().strip()
-                    if text:
-                        yield text
-                        full_response += text
+        self._cancelled.discard(session_id)
+        full_message = self._prompt(message, session_id, context)
+        self.add_message(session_id, "user", message)
 
-            await process.wait()
+        record = self.usage.start(session_id)
+        try:
+            error = ""
+            got_result = False
+            parts: List[str] = []
+            parser = StreamEventParser()
+            async with aclosing(self._events(full_message, session_id)) as events:
+                async for data in events:
+                    for event in parser.feed(data):
+                        if isinstance(event, ErrorEvent):
+                            # stderr 只在没有任何回复时才作为错误输出
+                            error = event.message
+                            continue
+                        if isinstance(event, TextDelta):
+                            self.usage.mark_first_token(record)
+                            parts.append(event.text)
+                        elif isinstance(event, ToolUse):
+                            record.tool_calls += 1
+                        elif isinstance(event, Result):
+                            got_result = True
+                            self.usage.apply_usage(record, event.usage, event.cost_usd)
+                            record.error = event.is_error
+                        yield event
+            full_response = "".join(parts)
 
             if full_response:
                 self.add_message(session_id, "assistant", full_response)
-            else:
-                # 如果没有收到流式数据，读取 stderr
-                stderr = await process.stderr.read()
-                if stderr:
-                    yield f"错误: {stderr.decode()}"
+
+            if self._was_cancelled(session_id):
+                yield TextDelta(f"\n\n{CANCELLED_NOTICE}")
+            elif got_result and not record.error:
+                await self._store_reply(cache_key, full_response, record.tool_calls)
+            elif error and not full_response:
+                record.error = True
+                yield ErrorEvent(error)
 
         except FileNotFoundError:
-            yield "错误: 找不到 claude 命令"
+            record.error = True
+            yield ErrorEvent("找不到 claude 命令")
         except Exception as e:
-            yield f"错误: {str(e)}"
-
-    async def chat_with_session(
+            record.error = True
+            yield ErrorEvent(str(e))
+        finally:
+            self.usage.finish(record)
+
+    async def _events(self, full_message: str, session_id: str) -> AsyncGenerator[Dict[str, Any], None]:
+        """产出本轮 stream-json 事件，并维护会话到 CLI 会话 ID 的映射"""
+        resume = self.conversations.get_cli_session(session_id)
+        if self.pool:
+            events = self._pool_events(full_message, session_id, resume)
+        else:
+            events = self._process_events(full_message, session_id, resume)
+
+        got_result = False
+        async with aclosing(events):
+            async for data in events:
+                msg_type = data.get("type")
+                got_result = got_result or msg_type == "result"
+                if data.get("session_id"):
+                    self.conversations.set_cli_session(session_id, data["session_id"])
+                elif msg_type == "stderr" and resume and not got_result:
+                    # 恢复失败（CLI 会话可能已失效），下一轮重新开始
+                    self.conversations.set_cli_session(session_id, None)
+                yield data
+
+    async def _process_events(
         self,
-        message: str,
+        full_message: str,
         session_id: str,
-        resume: bool = True
-    ) -> AsyncGenerator[str, None]:
-        """使用 claude 的会话管理功能"""
+        resume: Optional[str] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """冷启动一个 claude 进程，逐行产出 stream-json 事件"""
+        # 使用 stream-json 格式获取流式输出
+        args = [
+            self.claude_path,
+            "-p", full_message,
+            "--output-format", "stream-json",
+            "--include-partial-messages",
+            "--verbose",
+        ]
+        if resume:
+            args.extend(["--resume", resume])
+
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env={**os.environ, "NO_COLOR": "1"},
+            start_new_session=True
+        )
+        self._running[session_id] = process
 
         try:
-            args = [self.claude_path, "-p", message, "--output-format", "stream-json"]
-
-            if resume and session_id:
-                # 尝试恢复会话
-                args.extend(["--session-id", session_id])
-
-            process = await asyncio.create_subprocess_exec(
-                *args,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                env={**os.environ, "NO_COLOR": "1"}
-            )
-
-            full_response = ""
-
+            # 逐行读取 JSON 流（不受 readline 的 64KB 行长限制）
+            lines = LineReader(process.stdout)
             while True:
-                line = await process.stdout.readline()
-                if not line:
+                line = await lines.readline()
+                if line is None:
                     break
-
-                try:
-                    data = json.loads(line.decode().strip())
-                    if data.get("type") == "content_block_delta":
-                        delta = data.get("delta", {})
-                        if delta.get("type") == "text_delta":
-                            text = delta.get("text", "")
-                            yield text
-                            full_response += text
-                    elif data.get("type") == "result":
-                        result = data.get("result", "")
-                        if result and not full_response:
-                            yield result
-                except:
-                    pass
+                data = parse_line(line)
+                if data is not None:
+                    yield data
 
             await process.wait()
 
+            stderr = await process.stderr.read()
+            if stderr:
+                yield {"type": "stderr", "text": stderr.decode()}
+        finally:
+            # 消费方中途退出（断开、取消、超时）时杀掉进程组
+            self._running.pop(session_id, None)
+            await kill_process_group(process)
+
+    async def _pool_events(
+        self,
+        full_message: str,
+        session_id: str,
+        resume: Optional[str] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """从进程池借用预热进程，产出本轮 stream-json 事件"""
+        # 中途退出时 acquire 会强制杀掉该进程，不会带着半轮输出回到池中
+        async with self.pool.acquire(session_id, resume) as worker:
+            self._running[session_id] = worker.process
+            try:
+                await worker.send(full_message)
+                got_result = False
+                async with aclosing(worker.events()) as events:
+                    async for data in events:
+                        got_result = got_result or data.get("type") == "result"
+                        yield data
+                if not got_result and session_id not in self._cancelled:
+                    # 进程提前退出，本轮不完整
+                    stderr = await worker.read_stderr()
+                    if stderr:
+                        yield {"type": "stderr", "text": stderr}
+                    raise RuntimeError("claude 进程意外退出")
+            finally:
+                self._running.pop(session_id, None)
+
+    async def _chat_pooled(
+        self,
+        full_message: str,
+        session_id: str,
+        record: RequestRecord,
+        cache_key: Optional[str] = None
+    ) -> str:
+        """通过进程池完成一次非流式对话"""
+
+        async def collect():
+            response = ""
+            error = ""
+            parser = StreamEventParser()
+            async with aclosing(self._events(full_message, session_id)) as events:
+                async for data in events:
+                    for event in parser.feed(data):
+                        if isinstance(event, TextDelta):
+                            self.usage.mark_first_token(record)
+                        elif isinstance(event, ToolUse):
+                            record.tool_calls += 1
+                        elif isinstance(event, Result):
+                            response = event.text
+                            record.error = event.is_error
+                            self.usage.apply_usage(record, event.usage, event.cost_usd)
+                        elif isinstance(event, ErrorEvent):
+                            error = event.message
+            return response, error
+
+        try:
+            response, error = await asyncio.wait_for(collect(), timeout=300)  # 5分钟超时
+            if self._was_cancelled(session_id):
+                return CANCELLED_NOTICE
+            if not response and error:
+                record.error = True
+                return f"Claude CLI 错误: {error}"
+            self.add_message(session_id, "assistant", response)
+            if not record.error:
+                await self._store_reply(cache_key, response, record.tool_calls)
+            return response
+        except asyncio.TimeoutError:
+            record.error = True
+            return "请求超时（超过5分钟）"
+        except FileNotFoundError:
+            record.error = True
+            return "错误: 找不到 claude 命令，请确保 Claude Code CLI 已安装"
         except Exception as e:
-            yield f"错误: {str(e)}"
+            record.error = True
+            return f"调用 Claude 失败: {str(e)}"
 
 
 # 全局实例
@@ -1,11 +1,48 @@
 """命令执行服务"""
 
-import subprocess
+import asyncio
+import codecs
 import os
-import json
-import re
-from typing import Dict, Any, Optional, Tuple
+from typing import AsyncGenerator, Dict, Any, List, Optional, Tuple
 from app.config import settings
+from app.services.action_parser import find_actions
+from app.services.action_plan import ActionPlan, ActionResult, OutputCallback, ResultCallback
+from app.utils.atomic_file import atomic_open
+from app.utils.command_policy import CommandPolicy
+from app.utils.file_reader import FileRange
+from app.utils.patch import PatchError, apply_edits, apply_unified_diff, parse_unified_diff
+from app.utils.path_trie import PathPrefixMatcher
+from app.utils.process import kill_process_group
+from app.utils.sandbox import ResourceLimits, describe_exit
+
+
+# read_file 操作支持的范围参数
+RANGE_KEYS = ("offset", "length", "start_line", "end_line", "head", "tail")
+# 流式执行时每次读取的输出字节数，也是超长行分段产出的大小
+_STREAM_CHUNK = 64 * 1024
+
+
+def _range_options(action: Dict[str, Any]) -> Dict[str, Any]:
+    """从操作指令中取出读取范围参数"""
+    return {key: action[key] for key in (*RANGE_KEYS, "max_bytes") if action.get(key) is not None}
+
+
+async def _read_capped(
+    process: asyncio.subprocess.Process,
+    stream: asyncio.StreamReader,
+    limit: int
+) -> Tuple[bytes, bool]:
+    """读取输出，超过 limit 字节（0 为不限）时截断并终止命令，返回 (内容, 是否截断)"""
+    chunks = []
+    size = 0
+    while chunk := await stream.read(64 * 1024):
+        if limit and size + len(chunk) > limit:
+            chunks.append(chunk[:limit - size])
+            await kill_process_group(process)
+            return b"".join(chunks), True
+        chunks.append(chunk)
+        size += len(chunk)
+    return b"".join(chunks), False
 
 
 class ExecutorService:
@@ -14,34 +51,62 @@ class ExecutorService:
     def __init__(self):
         self.allowed_dirs = settings.allowed_dirs_list
         self.blocked_commands = settings.blocked_commands_list
+        # 每条命令的默认资源限制，操作中可进一步收紧
+        self.limits = ResourceLimits(
+            timeout=settings.command_timeout,
+            cpu_seconds=settings.command_cpu_seconds,
+            memory_mb=settings.command_memory_mb,
+            max_output_bytes=settings.command_max_output_bytes,
+            nice=settings.command_nice,
+            ionice=settings.command_ionice,
+            cgroup=settings.command_cgroup
+        )
+        # 白名单目录、命令规则只在启动时编译一次
+        self.path_matcher = PathPrefixMatcher(self.allowed_dirs)
+        self.command_policy = CommandPolicy(self.blocked_commands, settings.allowed_commands_list)
 
     def is_path_allowed(self, path: str) -> bool:
-        """检查路径是否在允许的目录内"""
-        abs_path = os.path.abspath(os.path.expanduser(path))
-        return any(abs_path.startswith(d) for d in self.allowed_dirs)
+        """检查路径（解析符号链接后）是否在允许的目录内"""
+        return self.path_matcher.matches(path)
 
     def is_command_blocked(self, command: str) -> bool:
-        """检查命令是否被禁止"""
-        return any(blocked in command for blocked in self.blocked_commands)
+        """检查命令是否被禁止（分词规范化后匹配，多余空格、引号、路径写法无法绕过）"""
+        return self.command_policy.is_blocked(command)
 
     def parse_action(self, response: str) -> Optional[Dict[str, Any]]:
-        """从 AI 响应中解析操作指令"""
-        # 查找 JSON 格式的操作指令
-        json_pattern = r'```json\s*(\{[^`]+\})\s*```'
-        matches = re.findall(json_pattern, response, re.DOTALL)
-
-        for match in matches:
-            try:
-                action = json.loads(match)
-                if "action" in action:
-                    return action
-            except json.JSONDecodeError:
-                continue
-
-        return None
-
-    def execute_command(self, command: str, cwd: Optional[str] = None) -> Tuple[bool, str]:
-        """执行 shell 命令"""
+        """从 AI 响应中解析操作指令（流式场景用 ActionDetector 增量识别）"""
+        actions = find_actions(response)
+        return actions[0] if actions else None
+
+    def parse_actions(self, response: str) -> List[Dict[str, Any]]:
+        """从 AI 响应中解析全部操作指令"""
+        return find_actions(response)
+
+    def plan(
+        self,
+        on_output: Optional[OutputCallback] = None,
+        on_result: Optional[ResultCallback] = None
+    ) -> ActionPlan:
+        """创建执行计划，可在回复流式输出期间逐个加入操作"""
+        return ActionPlan(self, settings.executor_max_parallel, on_output, on_result)
+
+    async def process_actions(self, actions: List[Dict[str, Any]]) -> List[ActionResult]:
+        """按依赖关系并发执行多个操作，返回每个操作的结果"""
+        plan = self.plan()
+        for action in actions:
+            plan.add(action)
+        try:
+            return await plan.wait()
+        finally:
+            await plan.cancel()
+
+    async def execute_command(
+        self,
+        command: str,
+        cwd: Optional[str] = None,
+        limits: Optional[ResourceLimits] = None
+    ) -> Tuple[bool, str]:
+        """执行 shell 命令（异步，不阻塞事件循环，受资源限制）"""
 
         # 安全检查
         if self.is_command_blocked(command):
@@ -50,48 +115,191 @@ class ExecutorService:
         if cwd and not self.is_path_allowed(cwd):
             return False, f"目录不在允许列表中: {cwd}"
 
+        limits = limits or self.limits
+        process = None
         try:
-            result = subprocess.run(
+            # 新建进程组，超时时连同子进程一起杀掉
+            process = await limits.spawn(
                 command,
-                shell=True,
-                capture_output=True,
-                text=True,
-                timeout=60,
-                cwd=cwd or os.getcwd()
+                cwd or os.getcwd(),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
             )
 
-            output = result.stdout
-            if result.stderr:
-                output += f"\n[stderr]: {result.stderr}"
+            # 等待进程退出也计入超时：关闭输出后继续运行的命令同样会被杀掉
+            (stdout, out_truncated), (stderr, err_truncated), _ = await asyncio.wait_for(
+                asyncio.gather(
+                    _read_capped(process, process.stdout, limits.max_output_bytes),
+                    _read_capped(process, process.stderr, limits.max_output_bytes),
+                    process.wait()
+                ),
+                timeout=limits.timeout
+            )
+
+            output = stdout.decode(errors="replace")
+            if stderr:
+                output += f"\n[stderr]: {stderr.decode(errors='replace')}"
 
-            if result.returncode != 0:
-                return False, f"命令执行失败 (code={result.returncode}):\n{output}"
+            if out_truncated or err_truncated:
+                return False, f"{output}\n…（输出超过 {limits.max_output_bytes} 字节，已截断并终止命令）"
+
+            if process.returncode != 0:
+                reason = describe_exit(process.returncode)
+                return False, f"命令执行失败 (code={process.returncode}){reason}:\n{output}"
 
             return True, output or "命令执行成功（无输出）"
 
-        except subprocess.TimeoutExpired:
-            return False, "命令执行超时（60秒）"
+        except asyncio.TimeoutError:
+            await kill_process_group(process)
+            return False, f"命令执行超时（{limits.timeout:g}秒）"
+        except asyncio.CancelledError:
+            await kill_process_group(process)
+            raise
         except Exception as e:
+            await kill_process_group(process)
             return False, f"执行错误: {str(e)}"
 
-    def read_file(self, path: str) -> Tuple[bool, str]:
-        """读取文件内容"""
+    async def execute_command_stream(
+        self,
+        command: str,
+        cwd: Optional[str] = None,
+        limits: Optional[ResourceLimits] = None
+    ) -> AsyncGenerator[str, None]:
+        """流式执行 shell 命令，按行产出输出（超长行分段产出），最后一块为执行状态"""
+
+        # 安全检查
+        if self.is_command_blocked(command):
+            yield f"❌ 命令被禁止执行: {command}"
+            return
+
+        if cwd and not self.is_path_allowed(cwd):
+            yield f"❌ 目录不在允许列表中: {cwd}"
+            return
+
+        limits = limits or self.limits
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + limits.timeout
+        process = None
+        try:
+            # stderr 合并到 stdout，保持输出顺序
+            process = await limits.spawn(
+                command,
+                cwd or os.getcwd(),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT
+            )
+
+            # 按块读取再自己切行，不受 readline 的行长限制；多字节字符可能被块切开，用增量解码
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            pending = b""
+            output_bytes = 0
+            while True:
+                chunk = await asyncio.wait_for(
+                    process.stdout.read(_STREAM_CHUNK),
+                    timeout=max(deadline - loop.time(), 0)
+                )
+                if not chunk:
+                    break
+                output_bytes += len(chunk)
+                if limits.max_output_bytes and output_bytes > limits.max_output_bytes:
+                    await kill_process_group(process)
+                    yield f"\n❌ 输出超过 {limits.max_output_bytes} 字节，已终止命令"
+                    return
+                pending += chunk
+                # 产出完整的行；没有换行的超长行攒够一块就产出
+                cut = pending.rfind(b"\n") + 1 or (len(pending) if len(pending) >= _STREAM_CHUNK else 0)
+                if cut:
+                    text = decoder.decode(pending[:cut])
+                    pending = pending[cut:]
+                    if text:
+                        yield text
+            text = decoder.decode(pending, final=True)
+            if text:
+                yield text
+
+            await asyncio.wait_for(process.wait(), timeout=max(deadline - loop.time(), 0))
+
+            if process.returncode != 0:
+                yield f"\n❌ 命令执行失败 (code={process.returncode}){describe_exit(process.returncode)}"
+            elif not output_bytes:
+                yield "✅ 命令执行成功（无输出）"
+            else:
+                yield "\n✅ 命令执行成功"
+
+        except asyncio.TimeoutError:
+            yield f"\n❌ 命令执行超时（{limits.timeout:g}秒）"
+        except Exception as e:
+            yield f"\n❌ 执行错误: {str(e)}"
+        finally:
+            # 超时、出错或调用方中途停止消费时都清理进程组
+            await kill_process_group(process)
+
+    def _open_range(self, path: str, options: Dict[str, Any]) -> Tuple[Optional[FileRange], str]:
+        """检查权限并打开待读取的范围，失败时返回 (None, 错误信息)"""
 
         abs_path = os.path.abspath(os.path.expanduser(path))
 
         if not self.is_path_allowed(abs_path):
-            return False, f"文件路径不在允许列表中: {path}"
+            return None, f"文件路径不在允许列表中: {path}"
 
-        if not os.path.exists(abs_path):
-            return False, f"文件不存在: {path}"
+        if not os.path.isfile(abs_path):
+            return None, f"文件不存在: {path}"
 
         try:
-            with open(abs_path, "r", encoding="utf-8") as f:
-                content = f.read()
-            return True, content
+            max_bytes = int(options.get("max_bytes") or settings.read_max_bytes)
+            max_bytes = min(max_bytes, settings.read_max_bytes)
+            file_range = FileRange(
+                abs_path,
+                max_bytes,
+                **{key: int(options[key]) for key in RANGE_KEYS if options.get(key) is not None}
+            )
+        except (TypeError, ValueError) as e:
+            return None, f"读取范围参数错误: {str(e)}"
+        except Exception as e:
+            return None, f"读取文件失败: {str(e)}"
+
+        if file_range.binary:
+            file_range.close()
+            return None, f"二进制文件，不显示内容（{file_range.size} 字节）: {path}"
+        return file_range, ""
+
+    def read_file(self, path: str, **options) -> Tuple[bool, str]:
+        """读取文件内容，支持字节 / 行范围，超过 read_max_bytes 截断"""
+
+        file_range, error = self._open_range(path, options)
+        if file_range is None:
+            return False, error
+
+        try:
+            with file_range:
+                parts = []
+                while chunk := file_range.read_chunk(settings.read_chunk_size):
+                    parts.append(chunk)
+                if file_range.truncated:
+                    parts.append(file_range.truncation_note())
+            return True, "".join(parts)
         except Exception as e:
             return False, f"读取文件失败: {str(e)}"
 
+    async def read_file_stream(self, path: str, **options) -> AsyncGenerator[str, None]:
+        """分块读取文件，逐块产出内容，最后一块为读取状态"""
+
+        file_range, error = await asyncio.to_thread(self._open_range, path, options)
+        if file_range is None:
+            yield f"❌ {error}"
+            return
+
+        try:
+            while chunk := await asyncio.to_thread(file_range.read_chunk, settings.read_chunk_size):
+                yield chunk
+            if file_range.truncated:
+                yield file_range.truncation_note()
+            yield f"\n✅ 读取完成（{file_range.stop - file_range.start} 字节）"
+        except Exception as e:
+            yield f"\n❌ 读取文件失败: {str(e)}"
+        finally:
+            file_range.close()
+
     def write_file(self, path: str, content: str) -> Tuple[bool, str]:
         """写入文件"""
 
@@ -101,15 +309,62 @@ class ExecutorService:
             return False, f"文件路径不在允许列表中: {path}"
 
         try:
-            # 确保目录存在
-            os.makedirs(os.path.dirname(abs_path), exist_ok=True)
-
-            with open(abs_path, "w", encoding="utf-8") as f:
+            # 先写临时文件再替换，中途失败不会留下半个文件
+            with atomic_open(abs_path) as f:
                 f.write(content)
             return True, f"文件已写入: {abs_path}"
         except Exception as e:
             return False, f"写入文件失败: {str(e)}"
 
+    def patch_file(self, path: str, diff: str) -> Tuple[bool, str]:
+        """应用 unified diff：逐行读取原文件写入临时文件，成功后原子替换"""
+
+        abs_path = os.path.abspath(os.path.expanduser(path))
+
+        if not self.is_path_allowed(abs_path):
+            return False, f"文件路径不在允许列表中: {path}"
+
+        try:
+            hunks = parse_unified_diff(diff)
+            if os.path.exists(abs_path):
+                with open(abs_path, "r", encoding="utf-8", newline="") as src, atomic_open(abs_path) as out:
+                    count = apply_unified_diff(src, hunks, out)
+            else:
+                # 只允许从空文件开始的补丁创建新文件
+                with atomic_open(abs_path) as out:
+                    count = apply_unified_diff([], hunks, out)
+            return True, f"已应用补丁（{count} 处修改）: {abs_path}"
+        except PatchError as e:
+            return False, f"补丁无法应用: {str(e)}"
+        except Exception as e:
+            return False, f"应用补丁失败: {str(e)}"
+
+    def edit_file(self, path: str, edits: List[Dict[str, Any]]) -> Tuple[bool, str]:
+        """按搜索/替换编辑文件，全部成功后原子写回"""
+
+        abs_path = os.path.abspath(os.path.expanduser(path))
+
+        if not self.is_path_allowed(abs_path):
+            return False, f"文件路径不在允许列表中: {path}"
+
+        if not os.path.isfile(abs_path):
+            return False, f"文件不存在: {path}"
+
+        try:
+            size = os.path.getsize(abs_path)
+            if size > settings.edit_max_bytes:
+                return False, f"文件过大（{size} 字节），请改用 patch_file: {path}"
+            with open(abs_path, "r", encoding="utf-8", newline="") as f:
+                content = f.read()
+            content = apply_edits(content, edits)
+            with atomic_open(abs_path) as f:
+                f.write(content)
+            return True, f"已编辑文件（{len(edits)} 处编辑）: {abs_path}"
+        except PatchError as e:
+            return False, f"编辑无法应用: {str(e)}"
+        except Exception as e:
+            return False, f"编辑文件失败: {str(e)}"
+
     async def process_action(self, action: Dict[str, Any]) -> str:
         """处理 AI 返回的操作指令"""
 
@@ -118,13 +373,13 @@ class ExecutorService:
         if action_type == "execute":
             command = action.get("command", "")
             description = action.get("description", "")
-            success, output = self.execute_command(command)
+            success, output = await self.execute_command(command, limits=self.limits.narrowed(action))
             status = "✅" if success else "❌"
             return f"{status} 执行命令: {command}\n{description}\n\n结果:\n{output}"
 
         elif action_type == "read_file":
             path = action.get("path", "")
-            success, content = self.read_file(path)
+            success, content = await asyncio.to_thread(self.read_file, path, **_range_options(action))
             status = "✅" if success else "❌"
             return f"{status} 读取文件: {path}\n\n{content}"
 
@@ -132,13 +387,52 @@ class ExecutorService:
             path = action.get("path", "")
             content = action.get("content", "")
             description = action.get("description", "")
-            success, result = self.write_file(path, content)
+            success, result = await asyncio.to_thread(self.write_file, path, content)
+            status = "✅" if success else "❌"
+            return f"{status} {result}\n{description}"
+
+        elif action_type == "patch_file":
+            path = action.get("path", "")
+            diff = action.get("diff", "")
+            description = action.get("description", "")
+            success, result = await asyncio.to_thread(self.patch_file, path, diff)
+            status = "✅" if success else "❌"
+            return f"{status} {result}\n{description}"
+
+        elif action_type == "edit_file":
+            path = action.get("path", "")
+            # 单个编辑可直接写在操作里
+            edits = action.get("edits") or [
+                {"search": action.get("search"), "replace": action.get("replace", ""), "all": action.get("all", False)}
+            ]
+            description = action.get("description", "")
+            success, result = await asyncio.to_thread(self.edit_file, path, edits)
             status = "✅" if success else "❌"
             return f"{status} {result}\n{description}"
 
         else:
             return f"未知操作类型: {action_type}"
 
+    async def process_action_stream(self, action: Dict[str, Any]) -> AsyncGenerator[str, None]:
+        """流式处理操作指令：命令输出逐行产出，文件分块产出，其他操作一次性产出结果"""
+
+        if action.get("action") == "read_file":
+            path = action.get("path", "")
+            yield f"📄 读取文件: {path}\n\n"
+            async for chunk in self.read_file_stream(path, **_range_options(action)):
+                yield chunk
+            return
+
+        if action.get("action") != "execute":
+            yield await self.process_action(action)
+            return
+
+        command = action.get("command", "")
+        description = action.get("description", "")
+        yield f"⚡ 执行命令: {command}\n{description}\n\n结果:\n"
+        async for chunk in self.execute_command_stream(command, limits=self.limits.narrowed(action)):
+            yield chunk
+
 
 # 全局实例
 executor_service = ExecutorService()
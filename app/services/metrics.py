@@ -0,0 +1,87 @@
+"""请求统计 - 记录每次对话的延迟与 token 用量，用于容量规划"""
+
+import time
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Any, Deque, Dict, List, Optional
+
+
+@dataclass
+class RequestRecord:
+    """单次请求的统计"""
+    session_id: str
+    started_at: float
+    first_token_ms: Optional[float] = None
+    duration_ms: float = 0.0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_creation_tokens: int = 0
+    cost_usd: float = 0.0
+    tool_calls: int = 0
+    error: bool = False
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(int(len(values) * pct), len(values) - 1)
+    return round(values[index], 1)
+
+
+class UsageStats:
+    """累计计数 + 最近 N 次请求的延迟分布"""
+
+    def __init__(self, window: int = 500):
+        self.recent: Deque[RequestRecord] = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_read_tokens = 0
+        self.cost_usd = 0.0
+
+    def start(self, session_id: str) -> RequestRecord:
+        return RequestRecord(session_id=session_id, started_at=time.monotonic())
+
+    def mark_first_token(self, record: RequestRecord):
+        if record.first_token_ms is None:
+            record.first_token_ms = (time.monotonic() - record.started_at) * 1000
+
+    def apply_usage(self, record: RequestRecord, usage: Dict[str, Any], cost_usd: Optional[float]):
+        """写入 CLI result 事件中的用量"""
+        record.input_tokens = usage.get("input_tokens", 0) or 0
+        record.output_tokens = usage.get("output_tokens", 0) or 0
+        record.cache_read_tokens = usage.get("cache_read_input_tokens", 0) or 0
+        record.cache_creation_tokens = usage.get("cache_creation_input_tokens", 0) or 0
+        record.cost_usd = cost_usd or 0.0
+
+    def finish(self, record: RequestRecord):
+        record.duration_ms = (time.monotonic() - record.started_at) * 1000
+        self.recent.append(record)
+        self.requests += 1
+        self.errors += int(record.error)
+        self.input_tokens += record.input_tokens
+        self.output_tokens += record.output_tokens
+        self.cache_read_tokens += record.cache_read_tokens
+        self.cost_usd += record.cost_usd
+
+    def summary(self) -> Dict[str, Any]:
+        durations = [r.duration_ms for r in self.recent]
+        first_tokens = [r.first_token_ms for r in self.recent if r.first_token_ms is not None]
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cache_read_tokens": self.cache_read_tokens,
+            "cost_usd": round(self.cost_usd, 4),
+            "duration_ms_p50": _percentile(durations, 0.5),
+            "duration_ms_p95": _percentile(durations, 0.95),
+            "first_token_ms_p50": _percentile(first_tokens, 0.5),
+            "first_token_ms_p95": _percentile(first_tokens, 0.95),
+        }
+
+    def recent_records(self, limit: int = 50) -> List[Dict[str, Any]]:
+        return [asdict(r) for r in list(self.recent)[-limit:]]
@@ -0,0 +1,173 @@
+"""回复缓存 - 相同上下文中的相同问题直接返回之前的回复，不再启动 claude"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Dict, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """忽略首尾空白、连续空白和大小写差异"""
+    return " ".join(prompt.split()).casefold()
+
+
+async def replay(text: str, chunk_size: int = 64, interval: float = 0.0) -> AsyncGenerator[str, None]:
+    """把完整回复按块重新产出，走与实时回复相同的流式路径
+
+    每块之间至少让出一次事件循环，interval > 0 时按该间隔放慢节奏。
+    """
+    chunk_size = max(chunk_size, 1)
+    for start in range(0, len(text), chunk_size):
+        yield text[start:start + chunk_size]
+        await asyncio.sleep(interval)
+
+
+class _SQLiteTier:
+    """磁盘层：进程重启后仍可命中，可被同机多个 worker 共享"""
+
+    def __init__(self, path: str):
+        path = os.path.abspath(os.path.expanduser(path))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, "
+                "response TEXT NOT NULL, "
+                "created_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)"
+            )
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def put(self, key: str, response: str, created_at: float, max_entries: int, expire_before: float):
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created_at) VALUES (?, ?, ?)",
+                    (key, response, created_at)
+                )
+                # 顺带清理过期和超出容量的旧记录
+                self._conn.execute("DELETE FROM responses WHERE created_at < ?", (expire_before,))
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key NOT IN "
+                    "(SELECT key FROM responses ORDER BY created_at DESC LIMIT ?)",
+                    (max_entries,)
+                )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """两级回复缓存：内存 LRU + 可选的 SQLite 磁盘层，均按 TTL 过期
+
+    键由规范化后的 prompt、会话上下文（附加上下文 + 历史消息）的哈希和影响输出的调用参数共同决定。
+    """
+
+    def __init__(self, ttl: float = 3600.0, max_entries: int = 1000, path: Optional[str] = None):
+        self.ttl = ttl
+        self.max_entries = max(max_entries, 1)
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._disk = _SQLiteTier(path) if path else None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(
+        prompt: str,
+        context: Optional[str],
+        options: Dict[str, Any],
+        history: Sequence[Dict[str, str]] = ()
+    ) -> str:
+        """计算缓存键"""
+        session_context = json.dumps([context or "", list(history)], ensure_ascii=False, sort_keys=True)
+        context_hash = hashlib.sha256(session_context.encode()).hexdigest()
+        payload = json.dumps(
+            [normalize_prompt(prompt), context_hash, options],
+            ensure_ascii=False,
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _expired(self, created_at: float) -> bool:
+        return time.time() - created_at > self.ttl
+
+    def _remember(self, key: str, response: str, created_at: float):
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[str]:
+        """查找缓存，未命中或已过期返回 None"""
+        entry = self._memory.get(key)
+        if entry is not None and self._expired(entry[1]):
+            del self._memory[key]
+            entry = None
+
+        if entry is None and self._disk:
+            try:
+                entry = await asyncio.to_thread(self._disk.get, key)
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache read failed: {e}")
+                entry = None
+            if entry is not None:
+                if self._expired(entry[1]):
+                    entry = None
+                else:
+                    self._remember(key, *entry)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._memory.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    async def put(self, key: str, response: str):
+        """写入缓存"""
+        now = time.time()
+        self._remember(key, response, now)
+        if self._disk:
+            try:
+                await asyncio.to_thread(
+                    self._disk.put, key, response, now, self.max_entries, now - self.ttl
+                )
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._memory),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "disk": self._disk is not None,
+        }
+
+    def close(self):
+        if self._disk:
+            self._disk.close()
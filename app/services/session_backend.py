@@ -0,0 +1,114 @@
+"""会话持久化后端"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+class SessionBackend:
+    """会话持久化后端接口（默认实现不做持久化）
+
+    会话记录格式: ``{"messages": [...], "cli_session_id": str | None}``
+    """
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """读取会话记录，不存在返回 None"""
+        return None
+
+    def save_many(self, sessions: Dict[str, Dict[str, Any]]):
+        """批量写入会话记录，消息和 CLI 会话都为空表示删除会话"""
+
+    def close(self):
+        """释放资源"""
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """本地 SQLite（WAL 模式）会话存储，服务重启后恢复会话
+
+    只供单个进程使用：会话载入内存后不再重新读取，写回时整体覆盖，
+    多个 worker 共用同一个数据库会互相覆盖同一会话的历史。
+    """
+
+    def __init__(self, path: str):
+        path = os.path.abspath(os.path.expanduser(path))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        # 读和批量写都在线程池中执行，各用一个连接：WAL 模式下读不会等待进行中的写事务
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, "
+                "messages TEXT NOT NULL, "
+                "cli_session_id TEXT, "
+                "updated_at REAL NOT NULL)"
+            )
+            # 兼容旧表结构
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+            if "cli_session_id" not in columns:
+                self._conn.execute("ALTER TABLE sessions ADD COLUMN cli_session_id TEXT")
+            self._conn.commit()
+        self._read_conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._read_lock:
+            row = self._read_conn.execute(
+                "SELECT messages, cli_session_id FROM sessions WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            messages = json.loads(row[0])
+        except json.JSONDecodeError:
+            messages = []
+        return {"messages": messages, "cli_session_id": row[1]}
+
+    def save_many(self, sessions: Dict[str, Dict[str, Any]]):
+        if not sessions:
+            return
+        now = time.time()
+        upserts = []
+        deletes = []
+        for sid, record in sessions.items():
+            if record["messages"] or record.get("cli_session_id"):
+                messages = json.dumps(record["messages"], ensure_ascii=False)
+                upserts.append((sid, messages, record.get("cli_session_id"), now))
+            else:
+                deletes.append((sid,))
+        with self._lock:
+            with self._conn:
+                if upserts:
+                    self._conn.executemany(
+                        "INSERT INTO sessions (session_id, messages, cli_session_id, updated_at) "
+                        "VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(session_id) DO UPDATE SET "
+                        "messages = excluded.messages, "
+                        "cli_session_id = excluded.cli_session_id, "
+                        "updated_at = excluded.updated_at",
+                        upserts
+                    )
+                if deletes:
+                    self._conn.executemany("DELETE FROM sessions WHERE session_id = ?", deletes)
+
+    def close(self):
+        with self._read_lock:
+            self._read_conn.close()
+        with self._lock:
+            self._conn.close()
+
+
+def create_backend(kind: str, path: str) -> SessionBackend:
+    """按配置创建后端"""
+    if kind == "sqlite":
+        return SQLiteSessionBackend(path)
+    if kind != "memory":
+        raise ValueError(f"未知的会话存储后端: {kind}")
+    return SessionBackend()
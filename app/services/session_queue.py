@@ -0,0 +1,92 @@
+"""会话轮次队列 - 同一会话的请求按到达顺序串行处理"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+
+@dataclass
+class _PendingMessage:
+    message: str
+    merged: bool = False
+
+
+@dataclass
+class _SessionState:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    pending: List[_PendingMessage] = field(default_factory=list)
+    waiting: int = 0
+
+
+@dataclass
+class Turn:
+    """一轮对话
+
+    merged 为 True 表示该消息已被前一轮合并处理，调用方无需再请求模型。
+    """
+    message: Optional[str]
+    merged: bool = False
+    count: int = 1
+
+
+class SessionTurnQueue:
+    """按会话排队的轮次锁
+
+    开启 merge 时，排队期间同一会话新到的消息会合并进下一轮的 prompt，
+    被合并的请求不再单独调用模型。
+    """
+
+    def __init__(self, merge: bool = False):
+        self.merge = merge
+        self._states: Dict[str, _SessionState] = {}
+
+    def position(self, session_id: str) -> int:
+        """新请求前面还有几轮（进行中 + 排队中）"""
+        state = self._states.get(session_id)
+        if state is None:
+            return 0
+        return state.waiting + (1 if state.lock.locked() else 0)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active_sessions": len(self._states),
+            "waiting": sum(s.waiting for s in self._states.values()),
+        }
+
+    @asynccontextmanager
+    async def turn(self, session_id: str, message: str):
+        """排队等到本会话的下一轮"""
+        state = self._states.setdefault(session_id, _SessionState())
+        entry = _PendingMessage(message)
+        state.pending.append(entry)
+        state.waiting += 1
+        acquired = False
+        try:
+            await state.lock.acquire()
+            acquired = True
+            state.waiting -= 1
+
+            if entry.merged:
+                yield Turn(message=None, merged=True)
+                return
+
+            # asyncio.Lock 按 FIFO 唤醒，此时自己一定是最早未处理的消息
+            if self.merge:
+                batch = [p for p in state.pending if not p.merged]
+            else:
+                batch = [entry]
+            for p in batch:
+                p.merged = True
+            state.pending = [p for p in state.pending if not p.merged]
+            yield Turn(message="\n\n".join(p.message for p in batch), count=len(batch))
+        finally:
+            if acquired:
+                state.lock.release()
+            else:
+                # 排队时被取消
+                state.waiting -= 1
+                if entry in state.pending:
+                    state.pending.remove(entry)
+            if not state.lock.locked() and state.waiting == 0 and not state.pending:
+                self._states.pop(session_id, None)
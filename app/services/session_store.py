@@ -0,0 +1,224 @@
+"""会话存储 - 有界的内存会话表，支持 LRU / 空闲 TTL 淘汰与内存统计
+
+内存表是持久化后端之前的一层缓存：会话首次访问时才从后端加载，
+修改先记入待写集合，由后台任务批量写回，不占用请求路径。
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Optional
+
+from app.services.session_backend import SessionBackend
+
+logger = logging.getLogger(__name__)
+
+
+def _message_size(message: Dict[str, str]) -> int:
+    """估算一条消息占用的字节数"""
+    return sum(len(k) + len(v) for k, v in message.items())
+
+
+@dataclass
+class Session:
+    """单个会话"""
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    # 对应的 claude CLI 会话 ID（用于 --resume）
+    cli_session_id: Optional[str] = None
+    last_access: float = field(default_factory=time.monotonic)
+    size: int = 0
+
+
+class SessionStore:
+    """按最近访问排序的会话表
+
+    超过 max_sessions 或 max_bytes 时淘汰最久未访问的会话，
+    空闲超过 idle_ttl 的会话在访问时顺带清理（从头部弹出，均摊 O(1)）。
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        idle_ttl: float = 3600,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_messages: int = 20,
+        backend: Optional[SessionBackend] = None,
+        flush_interval: float = 1.0
+    ):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.backend = backend or SessionBackend()
+        self.flush_interval = flush_interval
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._total_bytes = 0
+        self.evictions = 0
+        # 待写回后端的会话（淘汰出内存后仍保留到写回为止）
+        self._pending: Dict[str, Session] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """启动后台批量写回"""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """停止写回任务，并写回剩余修改"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        self.backend.close()
+
+    async def flush(self):
+        """把待写会话批量写回后端"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        batch = {
+            sid: {"messages": list(session.messages), "cli_session_id": session.cli_session_id}
+            for sid, session in pending.items()
+        }
+        try:
+            await asyncio.to_thread(self.backend.save_many, batch)
+        except Exception as e:
+            logger.error(f"Failed to persist sessions: {e}")
+            # 写失败的会话放回，等下次重试（期间的新修改优先）
+            for sid, session in pending.items():
+                self._pending.setdefault(sid, session)
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+            except asyncio.CancelledError:
+                break
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _drop(self, session_id: str):
+        session = self._sessions.pop(session_id)
+        self._total_bytes -= session.size
+
+    def _evict(self):
+        """淘汰过期会话以及超出容量的最久未访问会话"""
+        now = time.monotonic()
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if (
+                now - session.last_access <= self.idle_ttl
+                and len(self._sessions) <= self.max_sessions
+                and self._total_bytes <= self.max_bytes
+            ):
+                break
+            self._drop(session_id)
+            self.evictions += 1
+
+    def _from_record(self, record: Optional[Dict[str, Any]]) -> Session:
+        session = Session()
+        if record:
+            session.messages = list(record.get("messages") or [])
+            session.cli_session_id = record.get("cli_session_id")
+        return session
+
+    def _add(self, session_id: str, session: Session) -> Session:
+        session.last_access = time.monotonic()
+        session.size = sum(_message_size(m) for m in session.messages)
+        self._total_bytes += session.size
+        self._sessions[session_id] = session
+        return session
+
+    def _load(self, session_id: str) -> Session:
+        """内存未命中时从待写集合或后端加载（同步读取，通常已由 load() 预先加载）"""
+        session = self._pending.get(session_id)
+        if session is None:
+            record = None
+            try:
+                record = self.backend.load(session_id)
+            except Exception as e:
+                logger.error(f"Failed to load session {session_id}: {e}")
+            session = self._from_record(record)
+        return self._add(session_id, session)
+
+    async def load(self, session_id: str):
+        """把会话预先载入内存，后端读取放到线程中，不阻塞事件循环"""
+        if session_id in self._sessions or session_id in self._pending:
+            return
+        record = None
+        try:
+            record = await asyncio.to_thread(self.backend.load, session_id)
+        except Exception as e:
+            logger.error(f"Failed to load session {session_id}: {e}")
+        # 读取期间会话可能已被创建或修改，以内存中的为准
+        if session_id in self._sessions or session_id in self._pending:
+            return
+        self._add(session_id, self._from_record(record))
+        self._evict()
+
+    def _touch(self, session_id: str) -> Session:
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._load(session_id)
+        else:
+            session.last_access = time.monotonic()
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def get(self, session_id: str) -> List[Dict[str, str]]:
+        """获取会话消息（不存在则创建空会话）"""
+        session = self._touch(session_id)
+        self._evict()
+        return session.messages
+
+    def append(self, session_id: str, message: Dict[str, str]):
+        """追加消息，只保留最近 max_messages 条"""
+        session = self._touch(session_id)
+        session.messages.append(message)
+        added = _message_size(message)
+        session.size += added
+        self._total_bytes += added
+        while len(session.messages) > self.max_messages:
+            removed = _message_size(session.messages.pop(0))
+            session.size -= removed
+            self._total_bytes -= removed
+        self._pending[session_id] = session
+        self._evict()
+
+    def get_cli_session(self, session_id: str) -> Optional[str]:
+        """获取会话对应的 claude CLI 会话 ID"""
+        session = self._touch(session_id)
+        self._evict()
+        return session.cli_session_id
+
+    def set_cli_session(self, session_id: str, cli_session_id: Optional[str]):
+        """记录会话对应的 claude CLI 会话 ID"""
+        session = self._touch(session_id)
+        if session.cli_session_id != cli_session_id:
+            session.cli_session_id = cli_session_id
+            self._pending[session_id] = session
+
+    def clear(self, session_id: str):
+        """清空会话消息"""
+        if session_id in self._sessions:
+            self._drop(session_id)
+        session = Session()
+        self._sessions[session_id] = session
+        self._pending[session_id] = session
+
+    def stats(self) -> Dict[str, Any]:
+        """会话统计"""
+        return {
+            "sessions": len(self._sessions),
+            "bytes": self._total_bytes,
+            "evictions": self.evictions,
+            "pending_writes": len(self._pending),
+            "max_sessions": self.max_sessions,
+        }
@@ -0,0 +1,275 @@
+"""claude stream-json 输出的增量解析
+
+- ``LineReader`` 按块读取 stdout 并切行，不受 ``StreamReader.readline`` 的 64KB 行长限制
+- ``StreamEventParser`` 把每行事件转换为类型化事件，按（消息, 内容块）记录已输出的偏移，
+  每个增量只做常数量的工作，不再拿整段回复做前缀比较
+"""
+
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class LineReader:
+    """按块读取并切分行，支持超长行
+
+    缓冲区跨调用保留，同一个 stdout 可以被多轮请求连续读取（常驻进程）。
+    超过 max_line_bytes 的行被整行丢弃（截断的 JSON 也无法解析），避免撑爆内存。
+    """
+
+    def __init__(
+        self,
+        stream: asyncio.StreamReader,
+        chunk_size: int = 64 * 1024,
+        max_line_bytes: int = 64 * 1024 * 1024
+    ):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.max_line_bytes = max_line_bytes
+        self._buffer = bytearray()
+        self._scan = 0
+        self._eof = False
+        self._discarding = False
+
+    async def readline(self) -> Optional[bytes]:
+        """读取一行（不含换行符），EOF 时返回 None"""
+        while True:
+            newline = self._buffer.find(b"\n", self._scan)
+            if newline >= 0:
+                line = bytes(self._buffer[:newline])
+                del self._buffer[:newline + 1]
+                self._scan = 0
+                if self._discarding:
+                    # 超长行的尾部
+                    self._discarding = False
+                    continue
+                return line
+
+            if self._eof:
+                if not self._buffer or self._discarding:
+                    return None
+                line = bytes(self._buffer)
+                self._buffer.clear()
+                self._scan = 0
+                return line
+
+            if len(self._buffer) > self.max_line_bytes:
+                if not self._discarding:
+                    logger.warning(f"Dropping oversized stream line (> {self.max_line_bytes} bytes)")
+                self._buffer.clear()
+                self._discarding = True
+
+            # 只在新读入的部分查找换行
+            self._scan = len(self._buffer)
+            chunk = await self.stream.read(self.chunk_size)
+            if not chunk:
+                self._eof = True
+                continue
+            self._buffer += chunk
+
+
+def parse_line(line: bytes) -> Optional[Dict[str, Any]]:
+    """解析一行 stream-json；空行返回 None，非 JSON 行包装为 raw 事件"""
+    text = line.decode(errors="replace").strip()
+    if not text:
+        return None
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return {"type": "raw", "text": text}
+    if not isinstance(data, dict):
+        return {"type": "raw", "text": text}
+    return data
+
+
+# ==================== 类型化事件 ====================
+
+@dataclass
+class TextDelta:
+    """新增的回复文本"""
+    text: str
+
+
+@dataclass
+class ThinkingDelta:
+    """新增的思考内容"""
+    text: str
+
+
+@dataclass
+class ToolUse:
+    """模型调用工具"""
+    id: str
+    name: str
+    input: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class ToolResult:
+    """工具执行结果"""
+    tool_use_id: str
+    content: str = ""
+    is_error: bool = False
+
+
+@dataclass
+class Result:
+    """本轮结束，附带统计信息"""
+    text: str = ""
+    session_id: Optional[str] = None
+    is_error: bool = False
+    usage: Dict[str, Any] = field(default_factory=dict)
+    cost_usd: Optional[float] = None
+    duration_ms: Optional[int] = None
+    num_turns: Optional[int] = None
+
+
+@dataclass
+class ErrorEvent:
+    """CLI 错误输出"""
+    message: str
+
+
+class StreamEventParser:
+    """把 stream-json 事件字典转换为类型化事件
+
+    同一段文本可能既以增量（content_block_delta）到达，又在完整的 assistant
+    消息里再出现一次；按（消息 ID, 内容块序号）记录已输出长度，只输出新增部分。
+    assistant 消息可能每个内容块单独发送一次，content 中的位置与增量事件的块序号对不上，
+    所以某条消息已收到文本 / 思考增量后，其 assistant 消息里的文本 / 思考不再输出。
+    """
+
+    def __init__(self):
+        self._offsets: Dict[Tuple[str, int], int] = {}
+        self._tools_seen: set = set()
+        self._thinking_streamed: set = set()
+        # 收到过文本 / 思考增量的消息 ID
+        self._text_delta_messages: set = set()
+        self._thinking_delta_messages: set = set()
+        self._message_id = ""
+        self.has_text = False
+
+    def _emit_text(self, key: Tuple[str, int], text: str, absolute: bool) -> List[Any]:
+        """absolute 为 True 时 text 是该内容块的全文，否则是增量"""
+        offset = self._offsets.get(key, 0)
+        if absolute:
+            if len(text) <= offset:
+                return []
+            text = text[offset:]
+        if not text:
+            return []
+        self._offsets[key] = offset + len(text)
+        self.has_text = True
+        return [TextDelta(text)]
+
+    def _on_stream_event(self, event: Dict[str, Any]) -> List[Any]:
+        event_type = event.get("type")
+        if event_type == "message_start":
+            self._message_id = event.get("message", {}).get("id", "")
+        elif event_type == "content_block_delta":
+            delta = event.get("delta", {})
+            if delta.get("type") == "text_delta":
+                key = (self._message_id, event.get("index", 0))
+                self._text_delta_messages.add(self._message_id)
+                return self._emit_text(key, delta.get("text", ""), absolute=False)
+            if delta.get("type") == "thinking_delta":
+                self._thinking_delta_messages.add(self._message_id)
+                self._thinking_streamed.add((self._message_id, event.get("index", 0)))
+                return [ThinkingDelta(delta.get("thinking", ""))]
+        return []
+
+    def _on_assistant(self, message: Dict[str, Any]) -> List[Any]:
+        message_id = message.get("id", self._message_id)
+        for streamed in (self._text_delta_messages, self._thinking_delta_messages):
+            if message_id not in streamed and "" in streamed:
+                # 增量事件前没有 message_start，未命名消息的增量属于这条消息
+                streamed.discard("")
+                streamed.add(message_id)
+        text_streamed = message_id in self._text_delta_messages
+        thinking_streamed = message_id in self._thinking_delta_messages
+        events: List[Any] = []
+        for index, block in enumerate(message.get("content", [])):
+            block_type = block.get("type")
+            if block_type == "text":
+                if text_streamed:
+                    continue
+                events.extend(self._emit_text((message_id, index), block.get("text", ""), absolute=True))
+            elif block_type == "thinking":
+                if thinking_streamed:
+                    continue
+                if (message_id, index) not in self._thinking_streamed and block.get("thinking"):
+                    self._thinking_streamed.add((message_id, index))
+                    events.append(ThinkingDelta(block["thinking"]))
+            elif block_type == "tool_use":
+                tool_id = block.get("id", f"{message_id}:{index}")
+                if tool_id not in self._tools_seen:
+                    self._tools_seen.add(tool_id)
+                    events.append(ToolUse(tool_id, block.get("name", ""), block.get("input", {})))
+        return events
+
+    def _on_tool_results(self, message: Dict[str, Any]) -> List[Any]:
+        events: List[Any] = []
+        content = message.get("content", [])
+        if not isinstance(content, list):
+            return events
+        for block in content:
+            if block.get("type") != "tool_result":
+                continue
+            result = block.get("content", "")
+            if isinstance(result, list):
+                # 多段内容只取文本
+                result = "".join(part.get("text", "") for part in result if isinstance(part, dict))
+            events.append(ToolResult(
+                block.get("tool_use_id", ""),
+                str(result),
+                bool(block.get("is_error"))
+            ))
+        return events
+
+    def feed(self, data: Dict[str, Any]) -> List[Any]:
+        """处理一条事件，返回产生的类型化事件"""
+        msg_type = data.get("type")
+
+        if msg_type == "stream_event":
+            return self._on_stream_event(data.get("event", {}))
+
+        if msg_type in ("message_start", "content_block_delta"):
+            # 兼容未包装的事件格式
+            return self._on_stream_event(data)
+
+        if msg_type == "assistant":
+            return self._on_assistant(data.get("message", {}))
+
+        if msg_type == "user":
+            return self._on_tool_results(data.get("message", {}))
+
+        if msg_type == "result":
+            result = Result(
+                text=data.get("result", "") or "",
+                session_id=data.get("session_id"),
+                is_error=bool(data.get("is_error")),
+                usage=data.get("usage", {}) or {},
+                cost_usd=data.get("total_cost_usd", data.get("cost_usd")),
+                duration_ms=data.get("duration_ms"),
+                num_turns=data.get("num_turns")
+            )
+            events: List[Any] = []
+            if result.text and not self.has_text:
+                # 没有收到流式文本时用最终结果补齐
+                self.has_text = True
+                events.append(TextDelta(result.text))
+            events.append(result)
+            return events
+
+        if msg_type == "raw":
+            self.has_text = True
+            return [TextDelta(data["text"])]
+
+        if msg_type == "stderr":
+            return [ErrorEvent(data["text"])]
+
+        return []
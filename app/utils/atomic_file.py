@@ -0,0 +1,38 @@
+"""原子写文件 - 先写同目录临时文件，再 rename 覆盖目标"""
+
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import IO, Iterator
+
+# os.umask 只能“设置并返回旧值”，在导入时读取一次，避免在线程里临时修改
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+@contextmanager
+def atomic_open(path: str, encoding: str = "utf-8", newline: str = "") -> Iterator[IO[str]]:
+    """以写模式打开 path 的临时替身，正常退出时原子替换目标文件
+
+    中途出错时删除临时文件，目标文件保持原样；已有文件的权限会被保留。
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding=encoding, newline=newline) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            # 新文件：按 umask 设置默认权限（mkstemp 创建的是 0600）
+            os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
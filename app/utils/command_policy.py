@@ -0,0 +1,100 @@
+"""命令黑名单 - 分词、规范化后用预编译的组合正则匹配"""
+
+import os
+import re
+import shlex
+from typing import Iterable, List, Optional, Pattern
+
+# 分隔简单命令的 shell 运算符（;、&&、|| 、|、&、子 shell 括号）
+_SEPARATOR_CHARS = set(";&|()")
+# 之后紧跟的是另一个可执行文件的包装命令
+_WRAPPERS = {"sudo", "doas", "env", "exec", "command", "nohup", "time", "nice", "xargs", "builtin"}
+
+
+def _normalize_token(token: str, executable: bool) -> str:
+    if executable and "/" in token:
+        # /bin/rm 与 rm 视为同一个命令
+        token = os.path.basename(token) or token
+    if re.fullmatch(r"-[A-Za-z]{2,}", token):
+        # 组合短选项与顺序无关：-rf 与 -fr 相同
+        token = "-" + "".join(sorted(token[1:]))
+    return token
+
+
+def _tokenize(command: str) -> List[str]:
+    # 换行、反引号、$( 中的命令同样要检查，统一视为命令分隔
+    command = command.replace("\n", " ; ").replace("`", " ; ").replace("$(", " ; ( ")
+    lexer = shlex.shlex(command, posix=True, punctuation_chars=";&|()")
+    lexer.whitespace_split = True
+    lexer.commenters = ""
+    try:
+        return list(lexer)
+    except ValueError:
+        # 引号不配对时退化为按空白切分
+        return command.split()
+
+
+def split_commands(command: str) -> List[str]:
+    """把命令行拆成规范化的简单命令（空格连接的 token 序列）
+
+    带空白的 token（如 ``bash -c "..."`` 的脚本参数）会再被当作命令行展开检查。
+    """
+    segments: List[str] = []
+    current: List[str] = []
+    executable = True
+    for token in _tokenize(command):
+        if set(token) <= _SEPARATOR_CHARS:
+            if current:
+                segments.append(" ".join(current))
+            current = []
+            executable = True
+            continue
+        if any(c.isspace() for c in token):
+            segments.extend(split_commands(token))
+        token = _normalize_token(token, executable)
+        current.append(token)
+        executable = token in _WRAPPERS
+    if current:
+        segments.append(" ".join(current))
+    return segments
+
+
+def _normalized_rules(rules: Iterable[str]) -> List[str]:
+    return sorted({s for rule in rules for s in split_commands(rule)}, key=len, reverse=True)
+
+
+def _compile(rules: Iterable[str]) -> Optional[Pattern]:
+    """多条规则合并为一个正则，规则必须从 token 边界开始匹配"""
+    normalized = _normalized_rules(rules)
+    if not normalized:
+        return None
+    alternatives = "|".join(re.escape(rule) for rule in normalized)
+    return re.compile(f"(?:^| )(?:{alternatives})")
+
+
+class CommandPolicy:
+    """命令黑名单 + 例外白名单
+
+    规则与命令使用同样的方式分词和规范化（去引号、合并空白、去掉可执行文件路径、
+    排序组合短选项），因此多余空格、引号、``/bin/rm`` 之类的写法无法绕过。
+    命令行按 ``;``、``&&``、``|``、命令替换等拆成简单命令逐个检查；
+    简单命令命中黑名单且不与任何例外规则完全相同时禁止执行；例外只按整条简单命令比较，
+    ``rm -rf /tmp/build /`` 之类在例外后追加参数的写法不会被放行。
+    """
+
+    def __init__(self, blocked: Iterable[str], allowed: Iterable[str] = ()):
+        self._blocked = _compile(blocked)
+        self._allowed = frozenset(_normalized_rules(allowed))
+
+    def blocked_rule(self, command: str) -> Optional[str]:
+        """返回命中的黑名单规则，未命中返回 None"""
+        if self._blocked is None:
+            return None
+        for segment in split_commands(command):
+            match = self._blocked.search(segment)
+            if match and segment not in self._allowed:
+                return match.group(0).strip()
+        return None
+
+    def is_blocked(self, command: str) -> bool:
+        return self.blocked_rule(command) is not None
@@ -0,0 +1,140 @@
+"""文件分段读取 - 按字节 / 行范围读取，不把整个文件载入内存"""
+
+import codecs
+import os
+from typing import Optional, Tuple
+
+# 二进制检测读取的字节数
+SNIFF_BYTES = 8192
+# 按行定位时每次扫描的块大小
+_SCAN_BLOCK = 64 * 1024
+
+
+class FileRange:
+    """文件中待读取的一段
+
+    范围参数（优先级从高到低，只生效一种）：
+    - tail: 最后 N 行
+    - head: 前 N 行
+    - start_line / end_line: 行范围（从 1 开始，包含两端）
+    - offset / length: 字节范围
+
+    读取量超过 max_bytes 时截断，truncated 为 True。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int,
+        offset: Optional[int] = None,
+        length: Optional[int] = None,
+        start_line: Optional[int] = None,
+        end_line: Optional[int] = None,
+        head: Optional[int] = None,
+        tail: Optional[int] = None
+    ):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self.size = os.fstat(self._file.fileno()).st_size
+            sample = self._file.read(SNIFF_BYTES)
+            self.binary = b"\0" in sample
+            self.start, self.end = self._resolve(offset, length, start_line, end_line, head, tail)
+        except BaseException:
+            self._file.close()
+            raise
+        self.stop = min(self.end, self.start + max(max_bytes, 0))
+        self.truncated = self.stop < self.end
+        self._pos = self.start
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._file.seek(self.start)
+
+    def _resolve(self, offset, length, start_line, end_line, head, tail) -> Tuple[int, int]:
+        if tail is not None:
+            return self._tail_offset(tail), self.size
+        if head is not None:
+            return 0, self._line_offset(head + 1)
+        if start_line is not None or end_line is not None:
+            first = max(start_line or 1, 1)
+            start = self._line_offset(first)
+            if end_line is None:
+                return start, self.size
+            end = self._line_offset(end_line + 1, start, first) if end_line >= first else start
+            return start, end
+        start = min(max(offset or 0, 0), self.size)
+        end = self.size if length is None else min(start + max(length, 0), self.size)
+        return start, end
+
+    def _line_offset(self, line: int, pos: int = 0, current: int = 1) -> int:
+        """第 line 行起始的字节偏移（从 pos 处的第 current 行开始数），超出文件返回文件大小"""
+        remaining = line - current
+        if remaining <= 0:
+            return pos
+        self._file.seek(pos)
+        while True:
+            block = self._file.read(_SCAN_BLOCK)
+            if not block:
+                return self.size
+            index = -1
+            while remaining:
+                index = block.find(b"\n", index + 1)
+                if index < 0:
+                    break
+                remaining -= 1
+            if not remaining:
+                return pos + index + 1
+            pos += len(block)
+
+    def _tail_offset(self, lines: int) -> int:
+        """最后 lines 行起始的字节偏移，从文件末尾向前扫描"""
+        if lines <= 0 or not self.size:
+            return self.size
+        self._file.seek(self.size - 1)
+        # 末尾的换行不单独算一行
+        pos = self.size - 1 if self._file.read(1) == b"\n" else self.size
+        found = 0
+        while pos > 0:
+            block_start = max(pos - _SCAN_BLOCK, 0)
+            self._file.seek(block_start)
+            block = self._file.read(pos - block_start)
+            index = len(block)
+            while True:
+                index = block.rfind(b"\n", 0, index)
+                if index < 0:
+                    break
+                found += 1
+                if found == lines:
+                    return block_start + index + 1
+            pos = block_start
+        return 0
+
+    def read_chunk(self, chunk_size: int = 64 * 1024) -> str:
+        """读取下一块文本，读完返回空字符串（多字节字符不会被切开）"""
+        while self._pos < self.stop:
+            data = self._file.read(min(chunk_size, self.stop - self._pos))
+            if not data:
+                break
+            self._pos += len(data)
+            text = self._decoder.decode(data)
+            if text:
+                return text
+        if self.truncated:
+            # 截断处被切开的多字节字符直接丢弃
+            return ""
+        return self._decoder.decode(b"", final=True)
+
+    def truncation_note(self) -> str:
+        """截断提示，告诉调用方如何读取其余部分"""
+        return (
+            f"\n…（已截断：显示 {self.stop - self.start} / {self.end - self.start} 字节，"
+            f"文件共 {self.size} 字节；可用 offset/length 或 start_line/end_line 继续读取）"
+        )
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
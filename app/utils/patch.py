@@ -0,0 +1,145 @@
+"""文本补丁 - 流式应用 unified diff、按搜索/替换编辑"""
+
+import re
+from dataclasses import dataclass, field
+from typing import IO, Iterable, List, Tuple
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+_NO_NEWLINE = "\\ No newline at end of file"
+
+
+class PatchError(ValueError):
+    """补丁无法应用"""
+
+
+@dataclass
+class Hunk:
+    old_start: int
+    old_count: int
+    new_count: int
+    # (标记, 内容不含换行, 是否以换行结尾)，标记为 " " / "-" / "+"
+    lines: List[Tuple[str, str, bool]] = field(default_factory=list)
+    old_seen: int = 0
+    new_seen: int = 0
+
+    @property
+    def complete(self) -> bool:
+        return self.old_seen >= self.old_count and self.new_seen >= self.new_count
+
+    def add(self, tag: str, text: str):
+        self.lines.append((tag, text, True))
+        if tag != "+":
+            self.old_seen += 1
+        if tag != "-":
+            self.new_seen += 1
+
+
+def parse_unified_diff(diff: str) -> List[Hunk]:
+    """解析单个文件的 unified diff（忽略 ---/+++ 文件头和 hunk 之外的文字）"""
+    hunks: List[Hunk] = []
+    for raw in diff.splitlines():
+        match = _HUNK_HEADER.match(raw)
+        if match:
+            hunks.append(Hunk(
+                old_start=int(match.group(1)),
+                old_count=int(match.group(2)) if match.group(2) is not None else 1,
+                new_count=int(match.group(4)) if match.group(4) is not None else 1
+            ))
+            continue
+        hunk = hunks[-1] if hunks else None
+        if raw.startswith(_NO_NEWLINE[:2]):
+            if hunk and hunk.lines:
+                tag, text, _ = hunk.lines[-1]
+                hunk.lines[-1] = (tag, text, False)
+            continue
+        if hunk is None or hunk.complete:
+            # 文件头、说明文字
+            continue
+        if raw == "":
+            # 部分工具会去掉空上下文行前的空格
+            hunk.add(" ", "")
+        elif raw[0] in " -+":
+            hunk.add(raw[0], raw[1:])
+        else:
+            raise PatchError(f"无法识别的补丁行: {raw[:80]}")
+
+    if not hunks:
+        raise PatchError("补丁中没有 hunk（缺少 @@ 行）")
+    for number, hunk in enumerate(hunks, 1):
+        if not hunk.complete:
+            raise PatchError(f"第 {number} 个 hunk 的行数少于头部声明")
+    return hunks
+
+
+def _strip_eol(line: str) -> str:
+    return line.rstrip("\r\n")
+
+
+def apply_unified_diff(source: Iterable[str], hunks: List[Hunk], out: IO[str]) -> int:
+    """逐行读取原文件、写出打补丁后的内容，返回应用的 hunk 数
+
+    只按行号精确匹配上下文，不做模糊定位；不匹配时抛出 PatchError。
+    """
+    lines = iter(source)
+    line_no = 0  # 已读取的原文件行数
+    newline = "\n"
+
+    def next_line(number: int) -> str:
+        nonlocal line_no, newline
+        try:
+            line = next(lines)
+        except StopIteration:
+            raise PatchError(f"第 {number} 个 hunk 超出文件末尾（原文件共 {line_no} 行）")
+        if line_no == 0 and line.endswith("\r\n"):
+            # 新增行沿用原文件的换行风格
+            newline = "\r\n"
+        line_no += 1
+        return line
+
+    for number, hunk in enumerate(hunks, 1):
+        # 新建文件或在开头插入时 old_start 为 0
+        first = hunk.old_start if hunk.old_count else hunk.old_start + 1
+        if first - 1 < line_no:
+            raise PatchError(f"第 {number} 个 hunk 与前一个重叠或顺序错误")
+        while line_no < first - 1:
+            out.write(next_line(number))
+
+        for tag, text, has_eol in hunk.lines:
+            if tag == "+":
+                out.write(text + (newline if has_eol else ""))
+                continue
+            original = next_line(number)
+            if _strip_eol(original) != text:
+                raise PatchError(
+                    f"第 {number} 个 hunk 与原文件第 {line_no} 行不匹配: "
+                    f"期望 {text[:60]!r}，实际 {_strip_eol(original)[:60]!r}"
+                )
+            if tag == " ":
+                out.write(original)
+
+    # 其余内容原样复制
+    for line in lines:
+        out.write(line)
+    return len(hunks)
+
+
+def apply_edits(content: str, edits: List[dict]) -> str:
+    """按顺序应用搜索/替换编辑
+
+    每个编辑为 ``{"search": ..., "replace": ..., "all": false}``；
+    search 必须存在，未指定 all 时必须唯一，避免改错位置。
+    """
+    for number, edit in enumerate(edits, 1):
+        search = edit.get("search")
+        replace = edit.get("replace", "")
+        if not isinstance(search, str) or not search:
+            raise PatchError(f"第 {number} 个编辑缺少 search")
+        if not isinstance(replace, str):
+            raise PatchError(f"第 {number} 个编辑的 replace 必须是字符串")
+        count = content.count(search)
+        if count == 0:
+            raise PatchError(f"第 {number} 个编辑未找到要替换的内容: {search[:60]!r}")
+        if count > 1 and not edit.get("all"):
+            raise PatchError(f"第 {number} 个编辑匹配到 {count} 处，请提供更多上下文或设置 all")
+        content = content.replace(search, replace)
+    return content
@@ -0,0 +1,48 @@
+"""目录白名单匹配 - 按路径分段的前缀树"""
+
+import os
+from typing import Dict, Iterable, List
+
+# 标记“该节点本身是允许的目录”，路径分段不会是空字符串
+_ALLOWED = ""
+
+
+def _normalize(path: str) -> str:
+    """展开 ~、转为绝对路径并解析符号链接"""
+    return os.path.realpath(os.path.expanduser(path))
+
+
+def _segments(path: str) -> List[str]:
+    return [part for part in path.split(os.sep) if part]
+
+
+class PathPrefixMatcher:
+    """判断路径是否位于允许的目录内
+
+    目录在构造时解析一次符号链接并建成前缀树，检查时只需沿路径分段下行，
+    不会把 /tmpfoo 误判为 /tmp 的子路径；被检查的路径同样先解析符号链接，
+    指向白名单之外的链接会被拒绝。
+    """
+
+    def __init__(self, dirs: Iterable[str]):
+        self._root: Dict[str, dict] = {}
+        self.dirs: List[str] = []
+        for directory in dirs:
+            normalized = _normalize(directory)
+            self.dirs.append(normalized)
+            node = self._root
+            for part in _segments(normalized):
+                node = node.setdefault(part, {})
+            node[_ALLOWED] = {}
+
+    def matches(self, path: str) -> bool:
+        node = self._root
+        if _ALLOWED in node:
+            return True
+        for part in _segments(_normalize(path)):
+            node = node.get(part)
+            if node is None:
+                return False
+            if _ALLOWED in node:
+                return True
+        return False
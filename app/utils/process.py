@@ -0,0 +1,28 @@
+"""子进程工具"""
+
+import asyncio
+import os
+import signal
+from typing import Optional
+
+
+async def kill_process_group(process: Optional[asyncio.subprocess.Process]):
+    """杀掉进程所在的整个进程组（进程需以 start_new_session=True 启动）"""
+    if process is None or process.returncode is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    # 管道里还有未读的输出时 wait() 不会返回，读到 EOF 丢弃
+    streams = [s for s in (process.stdout, process.stderr) if s is not None]
+    await asyncio.gather(process.wait(), *(_discard(s) for s in streams))
+
+
+async def _discard(stream: asyncio.StreamReader):
+    try:
+        while await stream.read(64 * 1024):
+            pass
+    except RuntimeError:
+        # 另一个协程正在读取该管道，由它读到 EOF
+        pass
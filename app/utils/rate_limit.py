@@ -0,0 +1,152 @@
+"""令牌桶限流调度器"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional, Tuple
+
+
+class TokenBucket:
+    """令牌桶，支持自适应降速与暂停"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self, now: float) -> float:
+        """距离可取到一个令牌还需等待的秒数"""
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def backoff(self, now: float, pause: float):
+        """被限流：速率减半并暂停一段时间"""
+        self.rate = max(self.base_rate * 0.1, self.rate * 0.5)
+        self.tokens = 0
+        self.paused_until = max(self.paused_until, now + pause)
+
+    def recover(self):
+        """请求成功：逐步恢复到原始速率"""
+        if self.rate < self.base_rate:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * 0.05)
+
+
+class RateLimiter:
+    """全局 + 分端点令牌桶调度器
+
+    所有请求先按端点排队，同一端点内按 key（如卡片 ID）轮转出队，
+    保证多个活跃卡片公平分享额度；只有全局桶和端点桶都有令牌时才放行。
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: Optional[float] = None,
+        endpoint_limits: Optional[Dict[str, Tuple[float, float]]] = None
+    ):
+        self._app_bucket = TokenBucket(rate, burst or rate)
+        self._endpoint_limits = endpoint_limits or {}
+        self._endpoint_buckets: Dict[str, TokenBucket] = {}
+        self._queues: Dict[str, "OrderedDict[str, Deque[asyncio.Future]]"] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def _bucket(self, endpoint: str) -> Optional[TokenBucket]:
+        if endpoint not in self._endpoint_limits:
+            return None
+        if endpoint not in self._endpoint_buckets:
+            rate, burst = self._endpoint_limits[endpoint]
+            self._endpoint_buckets[endpoint] = TokenBucket(rate, burst)
+        return self._endpoint_buckets[endpoint]
+
+    @property
+    def pending(self) -> int:
+        """排队中的请求数"""
+        return sum(len(q) for queues in self._queues.values() for q in queues.values())
+
+    async def acquire(self, endpoint: str, key: str = "default"):
+        """等待一个发送名额"""
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+        future = asyncio.get_running_loop().create_future()
+        queues = self._queues.setdefault(endpoint, OrderedDict())
+        queues.setdefault(key, deque()).append(future)
+        self._wakeup.set()
+        await future
+
+    def report_rate_limited(self, endpoint: str, retry_after: float = 1.0):
+        """收到限流响应：端点和全局都退避"""
+        now = time.monotonic()
+        bucket = self._bucket(endpoint)
+        if bucket:
+            bucket.backoff(now, retry_after)
+        self._app_bucket.backoff(now, retry_after / 2)
+
+    def report_success(self, endpoint: str):
+        bucket = self._bucket(endpoint)
+        if bucket:
+            bucket.recover()
+        self._app_bucket.recover()
+
+    def _dispatch_once(self) -> float:
+        """放行所有当前可放行的请求，返回下次需要等待的秒数"""
+        next_delay = float("inf")
+        for endpoint in list(self._queues):
+            queues = self._queues[endpoint]
+            bucket = self._bucket(endpoint)
+            while queues:
+                now = time.monotonic()
+                delay = self._app_bucket.delay(now)
+                if bucket:
+                    delay = max(delay, bucket.delay(now))
+                if delay > 0:
+                    next_delay = min(next_delay, delay)
+                    break
+
+                # 轮转：取队首 key 的第一个请求，key 移到队尾
+                key, waiters = next(iter(queues.items()))
+                future = waiters.popleft()
+                if waiters:
+                    queues.move_to_end(key)
+                else:
+                    del queues[key]
+                if future.done():
+                    # 等待方已取消
+                    continue
+                self._app_bucket.consume()
+                if bucket:
+                    bucket.consume()
+                future.set_result(None)
+
+            if not queues:
+                del self._queues[endpoint]
+        return next_delay
+
+    async def _dispatch_loop(self):
+        while True:
+            self._wakeup.clear()
+            delay = self._dispatch_once()
+            if delay == float("inf"):
+                await self._wakeup.wait()
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
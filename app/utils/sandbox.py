@@ -0,0 +1,107 @@
+"""命令资源限制 - CPU 时间、内存、输出量、调度优先级和 cgroup"""
+
+import asyncio
+import os
+import resource
+import shlex
+import shutil
+import signal
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Optional
+
+# 执行方可在操作中收紧（不能放宽）的限制
+_OVERRIDABLE = ("timeout", "cpu_seconds", "memory_mb", "max_output_bytes")
+
+
+def _ulimit(flag: str, kind: int, value: int, scale: int = 1, grace: int = 0) -> str:
+    """生成设置软限制的 ulimit 命令，硬限制比软限制多 grace（不超过当前硬限制，非特权进程无法提高）"""
+    _, hard = resource.getrlimit(kind)
+    hard = value + grace if hard == resource.RLIM_INFINITY else hard // scale
+    # 先同时设置软硬限制，再单独降低软限制（硬限制低于当前软限制时会设置失败）
+    return f"ulimit {flag} {hard} && ulimit -S {flag} {min(value, hard)}"
+
+
+@dataclass(frozen=True)
+class ResourceLimits:
+    """单条命令的资源限制，0 表示不限制"""
+    timeout: float = 60.0
+    cpu_seconds: int = 0
+    memory_mb: int = 0
+    max_output_bytes: int = 0
+    nice: int = 0
+    ionice: bool = False
+    cgroup: str = ""
+
+    def narrowed(self, overrides: Dict[str, Any]) -> "ResourceLimits":
+        """按操作中的设置收紧限制"""
+        changes = {}
+        for key in _OVERRIDABLE:
+            value = overrides.get(key)
+            if value is None:
+                continue
+            try:
+                value = type(getattr(self, key))(value)
+            except (TypeError, ValueError):
+                continue
+            if value <= 0:
+                continue
+            current = getattr(self, key)
+            changes[key] = min(current, value) if current else value
+        return replace(self, **changes) if changes else self
+
+    def _preamble(self) -> List[str]:
+        """在执行命令的 shell 中先执行的语句：加入 cgroup、设置 rlimit"""
+        statements = []
+        if self.cgroup:
+            # 加入失败时不执行命令
+            procs = shlex.quote(os.path.join(self.cgroup, "cgroup.procs"))
+            statements.append(f"echo $$ > {procs} || exit 126")
+        if self.cpu_seconds:
+            # 到达软限制收到 SIGXCPU，忽略该信号的进程再过 1 秒被 SIGKILL
+            statements.append(_ulimit("-t", resource.RLIMIT_CPU, self.cpu_seconds, grace=1) + " || exit 126")
+        if self.memory_mb:
+            # ulimit -v 以 KB 为单位
+            statements.append(_ulimit("-v", resource.RLIMIT_AS, self.memory_mb * 1024, scale=1024) + " || exit 126")
+        return statements
+
+    def argv(self, command: str) -> List[str]:
+        """以 sh -c 执行命令
+
+        限制由包装命令和 shell 自身设置（nice、ionice、ulimit），不使用 preexec_fn：
+        服务中有工作线程（asyncio.to_thread），fork 后在子进程里执行 Python 代码并不安全。
+        """
+        preamble = self._preamble()
+        if preamble:
+            # 设置好限制后 exec 新的 shell 执行命令，命令本身作为参数传入，不需要转义
+            args = ["/bin/sh", "-c", "; ".join(preamble) + '; exec /bin/sh -c "$1"', "sh", command]
+        else:
+            args = ["/bin/sh", "-c", command]
+        if self.nice and shutil.which("nice"):
+            args = ["nice", "-n", str(self.nice), *args]
+        if self.ionice and shutil.which("ionice"):
+            # best-effort 类的最低优先级，不会像 idle 类那样在繁忙磁盘上饿死
+            args = ["ionice", "-c", "2", "-n", "7", *args]
+        return args
+
+    async def spawn(self, command: str, cwd: str, **kwargs) -> asyncio.subprocess.Process:
+        """启动受限的命令（独立进程组，便于整组终止）"""
+        return await asyncio.create_subprocess_exec(
+            *self.argv(command),
+            cwd=cwd,
+            start_new_session=True,
+            **kwargs
+        )
+
+
+def describe_exit(returncode: Optional[int]) -> str:
+    """被资源限制终止时给出原因"""
+    if returncode is not None and returncode > 128:
+        # 命令由 sh 执行，子进程被信号终止时 shell 的退出码为 128 + 信号值
+        returncode = 128 - returncode
+    if returncode == -signal.SIGXCPU:
+        return "（超出 CPU 时间限制）"
+    if returncode == -signal.SIGKILL:
+        return "（进程被强制终止）"
+    if returncode == -signal.SIGSEGV:
+        return "（可能超出内存限制）"
+    return ""
@@ -0,0 +1,43 @@
+"""带过期时间的去重集合"""
+
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+
+class ExpiringSet:
+    """按插入时间排序的过期集合
+
+    记录按插入顺序保存，过期清理只需从头部弹出，均摊 O(1)；
+    超过 max_size 时淘汰最早的记录。
+    """
+
+    def __init__(self, ttl: float = 300, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items: "OrderedDict[Hashable, float]" = OrderedDict()
+
+    def _evict(self, now: float):
+        while self._items:
+            key, added_at = next(iter(self._items.items()))
+            if now - added_at <= self.ttl and len(self._items) <= self.max_size:
+                break
+            self._items.popitem(last=False)
+
+    def add(self, key: Hashable) -> bool:
+        """加入集合；已存在（未过期）返回 False"""
+        now = time.monotonic()
+        self._evict(now)
+        if key in self._items:
+            return False
+        self._items[key] = now
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+        return True
+
+    def __contains__(self, key: Hashable) -> bool:
+        self._evict(time.monotonic())
+        return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
@@ -0,0 +1,67 @@
+"""命令黑名单回归测试：python -m pytest test_command_policy.py"""
+
+import pytest
+
+from app.utils.command_policy import CommandPolicy, split_commands
+
+BLOCKED = ["rm -rf /", "sudo rm", "mkfs", "dd if="]
+
+
+@pytest.fixture
+def policy():
+    return CommandPolicy(BLOCKED, ["rm -rf /tmp/build"])
+
+
+def test_split_commands_normalizes_tokens():
+    assert split_commands("/bin/rm  -fr '/' && echo ok | wc") == ["rm -fr /", "echo ok", "wc"]
+    assert split_commands("bash -c 'mkfs /dev/sda'") == ["mkfs /dev/sda", "bash -c mkfs /dev/sda"]
+
+
+@pytest.mark.parametrize("command", [
+    "rm -rf /",
+    "rm  -fr  /",
+    "/bin/rm -rf /",
+    "'rm' -rf '/'",
+    "echo ok; rm -rf /",
+    "true && rm -rf /home",
+    "echo $(rm -rf /)",
+    "echo `rm -rf /`",
+    "echo ok\nrm -rf /",
+    "sudo rm file",
+    "env /sbin/mkfs /dev/sda",
+    "bash -c 'rm -rf /'",
+    "dd if=/dev/zero of=/dev/sda",
+])
+def test_blocked(policy, command):
+    assert policy.is_blocked(command)
+
+
+@pytest.mark.parametrize("command", [
+    "ls -la /tmp",
+    "rm file.txt",
+    "git status && git diff",
+    "rm -rf /tmp/build",
+    "rm -fr '/tmp/build'",
+])
+def test_not_blocked(policy, command):
+    assert not policy.is_blocked(command)
+
+
+@pytest.mark.parametrize("command", [
+    "rm -rf /tmp/build /",
+    "rm -rf /tmp/build/../../",
+    "rm -rf /tmp/buildx /home",
+    "rm -rf /tmp/build; rm -rf /",
+    "sudo rm -rf /tmp/build",
+])
+def test_exception_must_match_whole_command(policy, command):
+    assert policy.is_blocked(command)
+
+
+def test_blocked_rule_reports_matching_rule(policy):
+    assert policy.blocked_rule("ls; mkfs.ext4 /dev/sda") == "mkfs"
+    assert policy.blocked_rule("ls") is None
+
+
+def test_empty_blocklist_allows_everything():
+    assert not CommandPolicy([]).is_blocked("rm -rf /")
@@ -0,0 +1,53 @@
+"""stream-json 解析回归测试：python -m pytest test_stream_parser.py"""
+
+from app.services.stream_parser import StreamEventParser, TextDelta, ThinkingDelta, Result
+
+
+def stream(event):
+    return {"type": "stream_event", "event": event}
+
+
+def texts(events):
+    return [e.text for e in events if isinstance(e, TextDelta)]
+
+
+def feed_all(parser, items):
+    events = []
+    for item in items:
+        events.extend(parser.feed(item))
+    return events
+
+
+def test_per_block_assistant_message_does_not_repeat_streamed_text():
+    events = feed_all(StreamEventParser(), [
+        stream({"type": "message_start", "message": {"id": "m1"}}),
+        stream({"type": "content_block_delta", "index": 0,
+                "delta": {"type": "thinking_delta", "thinking": "hmm"}}),
+        {"type": "assistant", "message": {"id": "m1", "content": [{"type": "thinking", "thinking": "hmm"}]}},
+        stream({"type": "content_block_delta", "index": 1, "delta": {"type": "text_delta", "text": "Hello"}}),
+        stream({"type": "content_block_delta", "index": 1, "delta": {"type": "text_delta", "text": " world"}}),
+        {"type": "assistant", "message": {"id": "m1", "content": [{"type": "text", "text": "Hello world"}]}},
+        {"type": "result", "result": "Hello world"},
+    ])
+    assert texts(events) == ["Hello", " world"]
+    assert [e.text for e in events if isinstance(e, ThinkingDelta)] == ["hmm"]
+    assert isinstance(events[-1], Result)
+
+
+def test_full_message_without_deltas_is_emitted_once():
+    message = {"type": "assistant", "message": {"id": "m1", "content": [{"type": "text", "text": "Hi"}]}}
+    events = feed_all(StreamEventParser(), [message, message, {"type": "result", "result": "Hi"}])
+    assert texts(events) == ["Hi"]
+
+
+def test_deltas_without_message_start():
+    events = feed_all(StreamEventParser(), [
+        {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": "Hi"}},
+        {"type": "assistant", "message": {"id": "m1", "content": [{"type": "text", "text": "Hi"}]}},
+    ])
+    assert texts(events) == ["Hi"]
+
+
+def test_result_text_used_when_nothing_streamed():
+    events = feed_all(StreamEventParser(), [{"type": "result", "result": "done"}])
+    assert texts(events) == ["done"]